@@ -0,0 +1,107 @@
+import asyncio
+import logging
+from aiogram.exceptions import TelegramBadRequest
+
+logger = logging.getLogger(__name__)
+
+TELEGRAM_TEXT_LIMIT = 4096
+
+# Channel audit log fed through a bounded queue and drained by one consumer
+# task, so handlers never wait on the log channel. Consecutive text entries are
+# joined into a single message of up to 4096 characters, sends are spaced by
+# interval seconds to stay under the channel rate limit, and entries arriving
+# while the queue is full are dropped and reported in the next message.
+class AuditLog:
+    def __init__(self, bot, chat_id, maxsize=1000, batch_size=20, interval=3.0, parse_mode="Markdown"):
+        self._bot = bot
+        self._chat_id = chat_id
+        self._queue = asyncio.Queue(maxsize)
+        self._batch_size = batch_size
+        self._interval = interval
+        self._parse_mode = parse_mode
+        self._task = None
+        self.dropped = 0
+        self._reported_dropped = 0
+
+    def __len__(self):
+        return self._queue.qsize()
+
+    # Queue a text line for the channel
+    def log_text(self, text):
+        self._put(("text", text, None))
+
+    # Queue a media re-send, e.g. log_media("send_photo", photo=file_id, caption=...)
+    def log_media(self, method, **kwargs):
+        self._put(("media", method, kwargs))
+
+    def _put(self, entry):
+        try:
+            self._queue.put_nowait(entry)
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    # Stop the consumer, giving queued entries up to timeout seconds to go out
+    async def stop(self, timeout=10):
+        if self._task is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("⚠️ Audit log stopped with %d entries still queued", self._queue.qsize())
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < self._batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            try:
+                for kind, payload, kwargs in self._group(batch):
+                    await self._send(kind, payload, kwargs)
+                    await asyncio.sleep(self._interval)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    # Merge runs of text entries into messages that fit the Telegram limit
+    def _group(self, batch):
+        grouped = []
+        dropped = self.dropped - self._reported_dropped
+        if dropped:
+            self._reported_dropped = self.dropped
+            batch = [("text", f"⚠️ {dropped} log entries dropped while the channel was busy", None)] + batch
+        for kind, payload, kwargs in batch:
+            if kind == "text":
+                payload = payload[:TELEGRAM_TEXT_LIMIT]
+                if grouped and grouped[-1][0] == "text" and len(grouped[-1][1]) + len(payload) + 2 <= TELEGRAM_TEXT_LIMIT:
+                    grouped[-1] = ("text", grouped[-1][1] + "\n\n" + payload, None)
+                    continue
+            grouped.append((kind, payload, kwargs))
+        return grouped
+
+    # A merged text message that Telegram cannot parse as Markdown (user text and
+    # names may contain unbalanced _, * or `) is sent again as plain text, so one
+    # entry cannot cost the whole batch
+    async def _send(self, kind, payload, kwargs):
+        try:
+            if kind == "text":
+                try:
+                    await self._bot.send_message(chat_id=self._chat_id, text=payload, parse_mode=self._parse_mode)
+                except TelegramBadRequest as e:
+                    if self._parse_mode is None:
+                        raise
+                    logger.warning("⚠️ Channel log entry could not be parsed, sending as plain text: %s", e)
+                    await self._bot.send_message(chat_id=self._chat_id, text=payload, parse_mode=None)
+            else:
+                await getattr(self._bot, payload)(chat_id=self._chat_id, **kwargs)
+        except Exception as e:
+            logger.error("❌ Error logging to channel %s: %s", self._chat_id, e)
@@ -0,0 +1,259 @@
+# Matchmaking benchmark and load simulation.
+#
+# Drives find_match / attempt_match / run_matching_pass from bot.py against
+# synthetic populations, with a fake Bot and an in-memory stand-in for the
+# MongoDB collections, so no Telegram token or database is needed:
+#
+#     python bench_matching.py
+#     python bench_matching.py --sizes 1000 10000 --probes 500 --seed 7
+#     python bench_matching.py --engine numpy
+#
+# For each waiting-pool size it reports per-call find_match latency, the
+# throughput of attempt_match and of a batch matching pass, and p50/p99
+# time-to-match from a simulated arrival and departure pattern.
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import time
+
+os.environ.setdefault('BOT_TOKEN', '123456:benchmark')
+os.environ.setdefault('CHANNEL_ID', '-1000000000000')
+os.environ.setdefault('GROUP_ID', '-1000000000001')
+os.environ.setdefault('GROUP_INVITE_LINK', 'https://t.me/+benchmark')
+os.environ.setdefault('MONGODB_URI', 'mongodb://localhost:27017')
+os.environ.setdefault('PROFILE_CACHE_SIZE', '10000000')
+os.environ.setdefault('PERSIST_COOLDOWNS', '0')
+
+import bot as matchmaking_bot
+from profiles import Profile
+from state_backend import InMemoryStateBackend
+from vector_matching import create_match_index
+
+GENDERS = ["male", "female"]
+RELIGIONS = ["Orthodox", "Muslim", "Protestant"]
+PARTNER_RELIGIONS = RELIGIONS + ["Any"]
+
+class FakeChat:
+    def __init__(self, user_id):
+        self.id = user_id
+        self.first_name = f"Bench {user_id}"
+        self.username = None
+
+class FakeMessage:
+    def __init__(self, message_id):
+        self.message_id = message_id
+
+# Stand-in for aiogram's Bot that answers instantly and counts calls
+class FakeBot:
+    def __init__(self):
+        self.calls = 0
+
+    async def get_chat(self, chat_id):
+        self.calls += 1
+        return FakeChat(chat_id)
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.calls += 1
+        return FakeMessage(self.calls)
+
+# Stand-in for the motor collections, keeping documents in a dict
+class InMemoryCollection:
+    def __init__(self):
+        self.documents = {}
+
+    async def find_one(self, query):
+        return self.documents.get(query['_id'])
+
+    async def bulk_write(self, operations, ordered=True):
+        for operation in operations:
+            document = operation._doc
+            target = self.documents.setdefault(operation._filter['_id'], {'_id': operation._filter['_id']})
+            for path, value in document.get('$set', {}).items():
+                *parents, field = path.split(".")
+                node = target
+                for parent in parents:
+                    node = node.setdefault(parent, {})
+                node[field] = value
+
+    async def create_index(self, *args, **kwargs):
+        return None
+
+# Random profile built from the document shape the setup handlers write
+def make_profile(rng):
+    min_age = rng.randint(18, 45)
+    return Profile.from_document({
+        "age": str(rng.randint(18, 60)),
+        "gender": rng.choice(GENDERS),
+        "religion": rng.choice(RELIGIONS),
+        "partner": {
+            "min_age": min_age,
+            "max_age": rng.randint(min_age, min(min_age + 20, 99)),
+            "gender": rng.choice(GENDERS),
+            "religion": rng.choice(PARTNER_RELIGIONS),
+        },
+    })
+
+def install_fakes():
+    fake_bot = FakeBot()
+    collection = InMemoryCollection()
+    matchmaking_bot.bot = fake_bot
+    matchmaking_bot.users_collection = collection
+    matchmaking_bot.user_store._collection = collection
+    matchmaking_bot.user_data._collection = collection
+    return fake_bot
+
+ENGINE = "python"
+
+# Clear all matchmaking state between scenarios
+def reset_state():
+    matchmaking_bot.state_backend = InMemoryStateBackend(match_index=create_match_index(ENGINE))
+    matchmaking_bot.message_id_map.clear()
+
+async def join_queue(user_id):
+    await matchmaking_bot.state_backend.join_queue(user_id, matchmaking_bot.user_data[user_id])
+
+def percentile(samples, fraction):
+    if not samples:
+        return float("nan")
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+async def populate(rng, size, first_id=1):
+    user_ids = range(first_id, first_id + size)
+    for user_id in user_ids:
+        matchmaking_bot.user_data[user_id] = make_profile(rng)
+        await join_queue(user_id)
+    return list(user_ids)
+
+# Per-call find_match latency for users outside the pool probing it
+async def bench_find_match(rng, size, probes):
+    reset_state()
+    await populate(rng, size)
+    probe_ids = range(10_000_000, 10_000_000 + probes)
+    for user_id in probe_ids:
+        matchmaking_bot.user_data[user_id] = make_profile(rng)
+    latencies = []
+    found = 0
+    for user_id in probe_ids:
+        started = time.perf_counter()
+        match_id = await matchmaking_bot.find_match(user_id)
+        latencies.append(time.perf_counter() - started)
+        found += match_id is not None
+    return latencies, found
+
+# attempt_match throughput: probes join a full pool one at a time. Also
+# returns the match-to-notify latencies reported through match_notify_hooks.
+async def bench_attempt_match(rng, size, probes):
+    reset_state()
+    await populate(rng, size)
+    probe_ids = range(20_000_000, 20_000_000 + probes)
+    for user_id in probe_ids:
+        matchmaking_bot.user_data[user_id] = make_profile(rng)
+    matched = 0
+    latencies = []
+    notify_latencies = []
+    hook = lambda user_id, match_id, seconds: notify_latencies.append(seconds)
+    matchmaking_bot.match_notify_hooks.append(hook)
+    started = time.perf_counter()
+    try:
+        for user_id in probe_ids:
+            call_started = time.perf_counter()
+            await join_queue(user_id)
+            matched += await matchmaking_bot.attempt_match(user_id)
+            latencies.append(time.perf_counter() - call_started)
+    finally:
+        matchmaking_bot.match_notify_hooks.remove(hook)
+    elapsed = time.perf_counter() - started
+    return matched, elapsed, latencies, notify_latencies
+
+# One batch matching pass over a full pool
+async def bench_matching_pass(rng, size):
+    reset_state()
+    await populate(rng, size)
+    started = time.perf_counter()
+    pairs = await matchmaking_bot.run_matching_pass()
+    return pairs, time.perf_counter() - started
+
+# Simulated arrivals and departures, one batch pass per tick. Time-to-match is
+# measured in simulated seconds from joining the queue to being paired.
+async def simulate(rng, size, ticks, tick_seconds, patience):
+    reset_state()
+    arrivals_per_tick = max(1, size // ticks)
+    joined_at = {}
+    times_to_match = []
+    next_id = 30_000_000
+    matched = 0
+    departed = 0
+    pass_time = 0.0
+    for tick in range(ticks):
+        now = tick * tick_seconds
+        for _ in range(rng.randint(arrivals_per_tick // 2, arrivals_per_tick * 3 // 2)):
+            next_id += 1
+            matchmaking_bot.user_data[next_id] = make_profile(rng)
+            await join_queue(next_id)
+            joined_at[next_id] = now
+        for user_id in [user_id for user_id, since in joined_at.items() if now - since > patience and rng.random() < 0.5]:
+            await matchmaking_bot.state_backend.leave_queue(user_id)
+            del joined_at[user_id]
+            departed += 1
+        started = time.perf_counter()
+        await matchmaking_bot.run_matching_pass()
+        pass_time += time.perf_counter() - started
+        active_matches = matchmaking_bot.state_backend.active_matches
+        for user_id in [user_id for user_id in joined_at if user_id in active_matches]:
+            times_to_match.append(now - joined_at.pop(user_id))
+            matched += 1
+        active_matches.clear()
+        matchmaking_bot.state_backend.matched_since.clear()
+    return matched, departed, pass_time, times_to_match
+
+def format_ms(seconds):
+    return f"{seconds * 1000:.3f}ms"
+
+async def run(sizes, probes, ticks, seed):
+    fake_bot = install_fakes()
+    for size in sizes:
+        rng = random.Random(seed)
+        print(f"\n=== {size} waiting users ===")
+        latencies, found = await bench_find_match(rng, size, probes)
+        print(
+            f"find_match:        p50 {format_ms(percentile(latencies, 0.5))}  "
+            f"p99 {format_ms(percentile(latencies, 0.99))}  "
+            f"mean {format_ms(statistics.fmean(latencies))}  ({found}/{probes} found a match)"
+        )
+        matched, elapsed, latencies, notify_latencies = await bench_attempt_match(rng, size, probes)
+        print(
+            f"attempt_match:     {matched / elapsed:.0f} matches/s  "
+            f"p50 {format_ms(percentile(latencies, 0.5))}  p99 {format_ms(percentile(latencies, 0.99))}  "
+            f"({matched}/{probes} matched)"
+        )
+        print(
+            f"match-to-notify:   p50 {format_ms(percentile(notify_latencies, 0.5))}  "
+            f"p99 {format_ms(percentile(notify_latencies, 0.99))}"
+        )
+        pairs, elapsed = await bench_matching_pass(rng, size)
+        print(f"run_matching_pass: {pairs} pairs in {elapsed:.3f}s ({pairs / elapsed:.0f} matches/s)")
+        matched, departed, pass_time, times_to_match = await simulate(rng, size, ticks, tick_seconds=2, patience=60)
+        print(
+            f"simulation:        {matched} matched, {departed} left the queue, "
+            f"{matched / pass_time:.0f} matches/s of pass time, "
+            f"time-to-match p50 {percentile(times_to_match, 0.5):.0f}s p99 {percentile(times_to_match, 0.99):.0f}s"
+        )
+    print(f"\nFake Bot API calls: {fake_bot.calls}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the matchmaking code without Telegram or MongoDB")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--probes", type=int, default=1000)
+    parser.add_argument("--ticks", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--engine", choices=["python", "numpy"], default="python")
+    args = parser.parse_args()
+    global ENGINE
+    ENGINE = args.engine
+    asyncio.run(run(args.sizes, args.probes, args.ticks, args.seed))
+
+if __name__ == "__main__":
+    main()
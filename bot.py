@@ -1,18 +1,38 @@
 from aiogram import Bot, Dispatcher, Router, F
 from aiogram.types import (
     Message,
-    InlineKeyboardMarkup,
-    InlineKeyboardButton,
     CallbackQuery,
-    ReplyKeyboardMarkup,
-    KeyboardButton,
     BotCommand,
-    BotCommandScopeAllPrivateChats
+    BotCommandScopeAllPrivateChats,
+    ChatMemberUpdated
 )
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
 import asyncio
 import os
 import datetime
+import logging
+import time
+from collections import OrderedDict
 from motor.motor_asyncio import AsyncIOMotorClient
+from audit_log import AuditLog
+from cache import AsyncTTLCache
+from cooldowns import CooldownStore
+from delayed_actions import DelayedActions
+from logging_setup import setup_logging
+from metrics import Registry
+from keyed_lock import KeyedLock
+import keyboards
+from keyboards import BEGIN_TEXT, END_CHAT_TEXT, HELP_TEXT, SETUP_TEXT, STOP_SEARCHING_TEXT
+from persistence import ProfileCache, WriteBehindStore
+from profiles import Profile
+from relay import MediaGroupCollector, archive_album, archive_call, can_relay_as_album, describe_message, relay_album, relay_message
+from reply_map import MessageIdMap
+from send_scheduler import SendScheduler
+from session_journal import SessionJournal
+from setup_wizard import STEPS, SetupWizard
+from state_backend import InMemoryStateBackend, MongoStateBackend
+from vector_matching import create_match_index
 
 # Bot token, channel ID, group ID, and group invite link setup
 BOT_TOKEN = os.getenv('BOT_TOKEN')
@@ -20,6 +40,58 @@ CHANNEL_ID = os.getenv('CHANNEL_ID')
 GROUP_ID = os.getenv('GROUP_ID')
 GROUP_INVITE_LINK = os.getenv('GROUP_INVITE_LINK')
 MONGODB_URI = os.getenv('MONGODB_URI')
+# Update ingestion: "polling" (default, for local use) or "webhook"
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+# Webhook mode: public base URL Telegram posts to, path and secret token, and the local address to listen on
+WEBHOOK_BASE_URL = os.getenv('WEBHOOK_BASE_URL')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', os.getenv('PORT', '8080')))
+# Tick of the batch matching scheduler in seconds; 0 disables it and matches inline from the handlers
+MATCH_INTERVAL = float(os.getenv('MATCH_INTERVAL', '2'))
+# How often pending profile changes are flushed to MongoDB, and how many dirty users force an early flush
+SAVE_INTERVAL = float(os.getenv('SAVE_INTERVAL', '5'))
+SAVE_BATCH_SIZE = int(os.getenv('SAVE_BATCH_SIZE', '500'))
+# Number of user profiles kept in memory; waiting and chatting users are always kept
+PROFILE_CACHE_SIZE = int(os.getenv('PROFILE_CACHE_SIZE', '10000'))
+# How long a user's display name is cached before it is looked up again
+DISPLAY_NAME_TTL = float(os.getenv('DISPLAY_NAME_TTL', '3600'))
+# How long a group membership check is trusted: members for MEMBERSHIP_TTL, non-members for MEMBERSHIP_NEGATIVE_TTL seconds
+MEMBERSHIP_TTL = float(os.getenv('MEMBERSHIP_TTL', '600'))
+MEMBERSHIP_NEGATIVE_TTL = float(os.getenv('MEMBERSHIP_NEGATIVE_TTL', '30'))
+# Channel audit log: queued entries before new ones are dropped, and seconds between channel posts
+AUDIT_LOG_QUEUE_SIZE = int(os.getenv('AUDIT_LOG_QUEUE_SIZE', '1000'))
+AUDIT_LOG_INTERVAL = float(os.getenv('AUDIT_LOG_INTERVAL', '3'))
+# Outbound message pacing: messages per second for the whole bot and per private chat
+SEND_GLOBAL_RATE = float(os.getenv('SEND_GLOBAL_RATE', '30'))
+SEND_CHAT_RATE = float(os.getenv('SEND_CHAT_RATE', '1'))
+# Reply threading keeps the most recent REPLY_MAP_SIZE messages per user, optionally only for REPLY_MAP_TTL seconds
+REPLY_MAP_SIZE = int(os.getenv('REPLY_MAP_SIZE', '1000'))
+REPLY_MAP_TTL = float(os.getenv('REPLY_MAP_TTL')) if os.getenv('REPLY_MAP_TTL') else None
+# Reply threading maps are kept for at most REPLY_MAP_USERS users, least recently used dropped first
+REPLY_MAP_USERS = int(os.getenv('REPLY_MAP_USERS', '10000'))
+# Cooldowns are kept in MongoDB (with a TTL index) so they survive restarts; set to 0 to keep them in memory only
+PERSIST_COOLDOWNS = os.getenv('PERSIST_COOLDOWNS', '1') != '0'
+# Where the waiting queue and active chats live: "memory" (default, one worker) or "mongodb" (shared by several workers)
+STATE_BACKEND = os.getenv('STATE_BACKEND', 'memory')
+# Matching engine for the memory backend: "python" (bucketed index) or "numpy" (vectorized, falls back to python without NumPy).
+# NumPy is an optional extra, not in requirements.txt: pip install numpy. The bucketed index is faster on large pools.
+MATCH_ENGINE = os.getenv('MATCH_ENGINE', 'python')
+# With the memory backend, queue and chat events are journaled to MongoDB and replayed on startup; set to 0 to disable.
+# A snapshot replaces the journal once JOURNAL_SNAPSHOT_EVENTS events have accumulated.
+SESSION_JOURNAL = os.getenv('SESSION_JOURNAL', '1') != '0'
+JOURNAL_SNAPSHOT_EVENTS = int(os.getenv('JOURNAL_SNAPSHOT_EVENTS', '1000'))
+
+# Local HTTP endpoint serving Prometheus metrics at /metrics; METRICS_PORT=0 disables it
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9090'))
+# Log level (DEBUG adds per-message relay logs and state dumps) and format: "text" or "json" lines
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text')
+
+# Time before two users who ended a chat can be matched again
+COOLDOWN_SECONDS = 4 * 60 * 60
 
 if not BOT_TOKEN:
     raise ValueError("No BOT_TOKEN found in environment variables. Please set it securely.")
@@ -31,29 +103,101 @@ if not GROUP_INVITE_LINK:
     raise ValueError("No GROUP_INVITE_LINK found in environment variables. Please set it securely.")
 if not MONGODB_URI:
     raise ValueError("No MONGODB_URI found in environment variables. Please set it securely.")
+if STATE_BACKEND not in ("memory", "mongodb"):
+    raise ValueError(f"Unknown STATE_BACKEND {STATE_BACKEND!r}. Use 'memory' or 'mongodb'.")
+if MATCH_ENGINE not in ("python", "numpy"):
+    raise ValueError(f"Unknown MATCH_ENGINE {MATCH_ENGINE!r}. Use 'python' or 'numpy'.")
+if LOG_FORMAT not in ("text", "json"):
+    raise ValueError(f"Unknown LOG_FORMAT {LOG_FORMAT!r}. Use 'text' or 'json'.")
+if BOT_MODE not in ("polling", "webhook"):
+    raise ValueError(f"Unknown BOT_MODE {BOT_MODE!r}. Use 'polling' or 'webhook'.")
+if BOT_MODE == "webhook" and not WEBHOOK_BASE_URL:
+    raise ValueError("No WEBHOOK_BASE_URL found in environment variables. It is required when BOT_MODE is 'webhook'.")
+if BOT_MODE == "webhook" and not WEBHOOK_SECRET:
+    raise ValueError("No WEBHOOK_SECRET found in environment variables. Please set it securely.")
+
+logger = logging.getLogger("bot")
 
 bot = Bot(token=BOT_TOKEN)
+# Every outbound send goes through the scheduler for pacing, ordering and 429 retries
+send_scheduler = SendScheduler(global_rate=SEND_GLOBAL_RATE, chat_rate=SEND_CHAT_RATE)
+bot.session.middleware(send_scheduler)
 router = Router()
 dp = Dispatcher()
 dp.include_router(router)
+audit_log = AuditLog(bot, CHANNEL_ID, maxsize=AUDIT_LOG_QUEUE_SIZE, interval=AUDIT_LOG_INTERVAL)
 
 # MongoDB setup
 client = AsyncIOMotorClient(MONGODB_URI)
 db = client['bot_database']
 users_collection = db['users']
+cooldowns_collection = db['cooldowns']
+sessions_collection = db['sessions']
+journal_collection = db['session_journal']
 
 # Initialize data structures
-user_data = {}
-active_matches = {}
-cooldown_tracker = {}
-waiting_users = set()
-waiting_start_times = {}
-message_id_map = {}
-
-# Button texts
-BEGIN_TEXT = "🚀 Begin"
-STOP_SEARCHING_TEXT = "⏹️ Stop Searching"
-END_CHAT_TEXT = "🔚 End Chat"
+if STATE_BACKEND == "mongodb":
+    state_backend = MongoStateBackend(
+        sessions_collection,
+        cooldowns_collection if PERSIST_COOLDOWNS else None,
+        db['leases'],
+        lease_seconds=max(30, MATCH_INTERVAL * 5)
+    )
+else:
+    state_backend = InMemoryStateBackend(
+        SessionJournal(journal_collection) if SESSION_JOURNAL else None,
+        create_match_index(MATCH_ENGINE)
+    )
+cooldowns = CooldownStore(cooldowns_collection if PERSIST_COOLDOWNS else None)
+# user_id -> (partner_id, MessageIdMap)
+message_id_map = OrderedDict()
+user_store = WriteBehindStore(users_collection, lambda user_id: profile_document(user_id), max_pending=SAVE_BATCH_SIZE)
+user_data = ProfileCache(
+    users_collection,
+    capacity=PROFILE_CACHE_SIZE,
+    is_pinned=state_backend.is_pinned,
+    is_dirty=user_store.is_dirty,
+    from_document=Profile.from_document,
+    # With the MongoDB state backend other workers edit profiles too
+    shared=STATE_BACKEND == "mongodb"
+)
+
+# Document shape of a cached profile for writing to MongoDB
+def profile_document(user_id):
+    profile = user_data.get(user_id)
+    return None if profile is None else profile.to_document()
+
+# A user's profile, created empty if they have none yet
+def get_profile(user_id):
+    return user_data.setdefault(user_id, Profile())
+
+# Metrics
+metrics = Registry(prefix="bot_")
+searches_started = metrics.counter("searches_started_total", "Users who joined the waiting queue")
+searches_rejected = metrics.counter("searches_rejected_total", "Begin presses rejected because the setup was incomplete")
+match_attempts = metrics.counter("match_attempts_total", "Inline match attempts")
+matches_made = metrics.counter("matches_total", "Pairs matched", ["source"])
+match_rollbacks = metrics.counter("match_rollbacks_total", "Claimed pairs released because a user could not be notified")
+match_attempt_seconds = metrics.histogram("match_attempt_seconds", "Time to find, claim and announce an inline match")
+matching_pass_seconds = metrics.histogram("matching_pass_seconds", "Time of one batch matching pass including announcements")
+match_notify_seconds = metrics.histogram("match_notify_seconds", "Time from claiming a pair to notifying both users")
+messages_relayed = metrics.counter("messages_relayed_total", "Messages relayed between chat partners", ["type"])
+relay_errors = metrics.counter("relay_errors_total", "Messages that failed to relay")
+relay_seconds = metrics.histogram("relay_seconds", "Time to relay one message to the partner")
+profile_updates = metrics.counter("profile_updates_total", "Profile changes queued for writing")
+profile_saves = metrics.counter("profile_saved_users_total", "Users written to MongoDB by bulk saves")
+profile_save_errors = metrics.counter("profile_save_errors_total", "Failed bulk saves of user profiles")
+profile_save_seconds = metrics.histogram("profile_save_seconds", "Time of one bulk save of user profiles to MongoDB")
+metrics.gauge("pending_profile_writes", "Users with unsaved profile changes").set_function(lambda: len(user_store))
+metrics.gauge("profile_cache_size", "User profiles held in memory").set_function(lambda: len(user_data))
+metrics.gauge("cooldowns", "Pairs on cooldown").set_function(lambda: len(cooldowns))
+metrics.gauge("audit_log_queue", "Audit log entries waiting to be posted").set_function(lambda: len(audit_log))
+metrics.gauge("audit_log_dropped", "Audit log entries dropped because the queue was full").set_function(lambda: audit_log.dropped)
+metrics.gauge("delayed_actions", "Deferred UI edits waiting to run").set_function(lambda: len(delayed_actions))
+metrics.gauge("message_map_bytes", "Approximate memory used by reply threading maps").set_function(lambda: message_map_memory_bytes())
+if STATE_BACKEND == "memory":
+    metrics.gauge("waiting_users", "Users in the waiting queue").set_function(lambda: len(state_backend.waiting_users))
+    metrics.gauge("active_chats", "Active chats").set_function(lambda: len(state_backend.active_matches) // 2)
 
 # Function to get gender emoji
 def get_gender_emoji(gender):
@@ -64,132 +208,189 @@ def get_gender_emoji(gender):
     else:
         return "❓"
 
-# Function to save all user data to MongoDB (for periodic save)
+# Function to write all pending user changes to MongoDB in one bulk write
 async def save_user_data():
-    for user_id, data in user_data.items():
-        try:
-            await users_collection.replace_one(
-                {'_id': user_id},
-                {'_id': user_id, **data},
-                upsert=True
-            )
-        except Exception as e:
-            print(f"❌ Error saving user {user_id} to MongoDB: {e}")
-    print(f"✅ All user data saved to MongoDB")
+    try:
+        with profile_save_seconds.time():
+            written = await user_store.flush()
+        profile_saves.inc(written)
+        if written:
+            logger.info("✅ Saved %d changed users to MongoDB", written)
+    except Exception as e:
+        profile_save_errors.inc()
+        logger.error("❌ Error saving user data to MongoDB: %s", e)
+
+# Write one user's pending profile changes now. With the MongoDB state backend
+# other workers read the profile as soon as the user is in the shared queue.
+async def save_user_now(user_id):
+    try:
+        await user_store.flush([user_id])
+    except Exception as e:
+        profile_save_errors.inc()
+        logger.error("❌ Error saving user %s to MongoDB: %s", user_id, e)
 
-# Function to update a single user's data in MongoDB
-async def update_user_data(user_id):
+# Function to queue a single user's changed fields for the next bulk write
+def update_user_data(user_id, *fields):
     if user_id in user_data:
-        user_info = user_data[user_id]
-        try:
-            await users_collection.replace_one(
-                {'_id': user_id},
-                {'_id': user_id, **user_info},
-                upsert=True
-            )
-            print(f"✅ Updated user {user_id} in MongoDB")
-        except Exception as e:
-            print(f"❌ Error updating user {user_id} in MongoDB: {e}")
+        user_store.mark_dirty(user_id, *fields)
+        profile_updates.inc()
     else:
-        print(f"⚠️ User {user_id} not found in user_data")
+        logger.warning("⚠️ User %s not found in user_data", user_id)
+
+# Function to load a single user's data from MongoDB the first time it is needed
+async def load_user_data(user_id):
+    try:
+        await user_data.load(user_id)
+    except Exception as e:
+        logger.error("❌ Error loading user %s from MongoDB: %s", user_id, e)
+        return
+    track_setup_completeness(user_id)
+
+# Updates from one user are handled one at a time, in arrival order, while
+# different users' updates run concurrently. Handlers never take another user's
+# lock; changes that involve two users go through the state backend's atomic
+# claim_pair / release_pair instead, so a candidate cannot be claimed twice.
+user_locks = KeyedLock()
+
+@dp.update.outer_middleware()
+async def serialize_user_updates_middleware(handler, event, data):
+    user = data.get("event_from_user")
+    if user is None:
+        return await handler(event, data)
+    async with user_locks.hold(user.id):
+        return await handler(event, data)
 
-# Function for immediate (non-awaited) saving of a single user's data
-def update_user_data_now(user_id):
-    asyncio.create_task(update_user_data(user_id))
+# Deferred actions. Keyed by user ID: UI edits, such as going back to the setup
+# menu after a confirmation, dropped as soon as the user sends a message or
+# presses a button. Keyed by (user ID, "setup"): the match re-check after the
+# user leaves the setup wizard early, which is not dropped that way.
+delayed_actions = DelayedActions()
 
-# Function to load user data from MongoDB
-async def load_user_data():
-    global user_data
-    user_data = {}
+@dp.update.outer_middleware()
+async def cancel_delayed_actions_middleware(handler, event, data):
+    user = data.get("event_from_user")
+    if user is not None and (event.message is not None or event.callback_query is not None):
+        delayed_actions.cancel(user.id)
+    return await handler(event, data)
+
+# Load the sender's profile before a handler that reads it runs: private-chat
+# messages and button presses. Group messages and chat_member updates never
+# touch profiles, so they skip the MongoDB read.
+@dp.update.outer_middleware()
+async def load_user_data_middleware(handler, event, data):
+    user = data.get("event_from_user")
+    if user is not None and (
+        (event.message is not None and event.message.chat.type == "private")
+        or event.callback_query is not None
+    ):
+        await load_user_data(user.id)
+    return await handler(event, data)
+
+# Display names for channel logs, cached and refreshed from incoming updates
+def format_display_name(user_id, user):
+    return user.first_name or user.username or f"User {user_id}"
+
+async def fetch_display_name(user_id):
+    return format_display_name(user_id, await bot.get_chat(user_id))
+
+display_names = AsyncTTLCache(fetch_display_name, ttl=DISPLAY_NAME_TTL)
+
+async def get_display_name(user_id):
     try:
-        async for document in users_collection.find():
-            user_id = document['_id']
-            user_data[user_id] = {k: v for k, v in document.items() if k != '_id'}
-        print(f"✅ Loaded data for {len(user_data)} users from MongoDB")
+        return await display_names.get(user_id)
     except Exception as e:
-        print(f"❌ Error loading user data from MongoDB: {e}")
+        logger.warning("Error looking up display name for user %s: %s", user_id, e)
+        return f"User {user_id}"
+
+@dp.update.outer_middleware()
+async def display_name_middleware(handler, event, data):
+    user = data.get("event_from_user")
+    if user is not None:
+        display_names.set(user.id, format_display_name(user.id, user))
+    return await handler(event, data)
+
+def is_member_status(status):
+    return status not in ['left', 'kicked']
 
-# Helper function to check if a user is a group member
+async def fetch_group_membership(user_id):
+    member = await bot.get_chat_member(chat_id=GROUP_ID, user_id=user_id)
+    return is_member_status(member.status)
+
+# Membership answers are cached, non-members for a shorter time so joining is noticed quickly
+group_members = AsyncTTLCache(
+    fetch_group_membership,
+    ttl=lambda is_member: MEMBERSHIP_TTL if is_member else MEMBERSHIP_NEGATIVE_TTL
+)
+
+# Helper function to check if a user is a group member; failed lookups are not cached
 async def is_group_member(user_id: int) -> bool:
     try:
-        member = await bot.get_chat_member(chat_id=GROUP_ID, user_id=user_id)
-        return member.status not in ['left', 'kicked']
+        return await group_members.get(user_id)
     except Exception as e:
-        print(f"Error checking group membership for user {user_id}: {e}")
+        logger.warning("Error checking group membership for user %s: %s", user_id, e)
         return False
 
+def is_group_chat(chat):
+    return str(chat.id) == GROUP_ID or (chat.username is not None and f"@{chat.username}" == GROUP_ID)
+
+# Keep the membership cache current from the group's chat_member updates
+@router.chat_member()
+async def handle_group_member_update(update: ChatMemberUpdated):
+    if is_group_chat(update.chat):
+        group_members.set(update.new_chat_member.user.id, is_member_status(update.new_chat_member.status))
+
 # Function to send join group message
 async def send_join_group_message(message: Message):
-    join_button = InlineKeyboardButton(text="Join Group", url=GROUP_INVITE_LINK)
-    join_keyboard = InlineKeyboardMarkup(inline_keyboard=[[join_button]])
     await message.answer(
         text=" Please join the group to use the bot.",
-        reply_markup=join_keyboard
+        reply_markup=keyboards.join_group_keyboard(GROUP_INVITE_LINK)
     )
 
+# Users whose profile has every field set. Fields cannot be cleared, so a user
+# stays in the set once added, even after their profile leaves the cache.
+complete_users = set()
+
+# Add a user to complete_users if their in-memory profile is complete
+def track_setup_completeness(user_id):
+    profile = user_data.get(user_id)
+    if profile is not None and profile.is_complete():
+        complete_users.add(user_id)
+
 # Helper function to check if setup is complete
 def is_setup_complete(user_id):
-    if user_id not in user_data:
-        return False, ["Age", "Gender", "Religion", "Partner Minimum Age", "Partner Maximum Age", "Partner Gender", "Partner Religion"]
-    user_prefs = user_data[user_id]
-    missing_fields = []
-    if "age" not in user_prefs or user_prefs["age"] == "Not set":
-        missing_fields.append("Age")
-    if "gender" not in user_prefs or user_prefs["gender"] == "Not set":
-        missing_fields.append("Gender")
-    if "religion" not in user_prefs or user_prefs["religion"] == "Not set":
-        missing_fields.append("Religion")
-    if "partner" not in user_prefs:
-        missing_fields.extend(["Partner Minimum Age", "Partner Maximum Age", "Partner Gender", "Partner Religion"])
-    else:
-        if "min_age" not in user_prefs["partner"] or user_prefs["partner"]["min_age"] == "Not set":
-            missing_fields.append("Partner Minimum Age")
-        if "max_age" not in user_prefs["partner"] or user_prefs["partner"]["max_age"] == "Not set":
-            missing_fields.append("Partner Maximum Age")
-        if "gender" not in user_prefs["partner"] or user_prefs["partner"]["gender"] == "Not set":
-            missing_fields.append("Partner Gender")
-        if "religion" not in user_prefs["partner"] or user_prefs["partner"]["religion"] == "Not set":
-            missing_fields.append("Partner Religion")
-    return len(missing_fields) == 0, missing_fields
+    return user_id in complete_users
+
+# Labels of the fields a user still has to set up
+def missing_setup_fields(user_id):
+    return user_data.get(user_id, Profile()).missing_fields()
+
+# Helper functions for the per-user reply threading maps. A map belongs to one
+# chat partner and starts over when the user is seen with another one, which
+# also covers chats ended on another worker. The least recently used maps are
+# dropped once more than REPLY_MAP_USERS users have one.
+def get_message_map(user_id, partner_id):
+    entry = message_id_map.get(user_id)
+    if entry is None or entry[0] != partner_id:
+        entry = message_id_map[user_id] = (partner_id, MessageIdMap(REPLY_MAP_SIZE, REPLY_MAP_TTL))
+    message_id_map.move_to_end(user_id)
+    while len(message_id_map) > REPLY_MAP_USERS:
+        message_id_map.popitem(last=False)
+    return entry[1]
+
+def message_map_memory_bytes():
+    return sum(message_map.nbytes() for _, message_map in message_id_map.values())
 
 # Helper function to get user state
-def get_user_state(user_id):
-    if user_id in active_matches:
-        return "chatting"
-    elif user_id in waiting_users:
-        return "searching"
-    else:
-        return "idle"
+async def get_user_state(user_id):
+    return await state_backend.get_state(user_id)
 
 # Define the Reply Keyboard with dynamic state-based buttons
 def get_main_keyboard(state="idle", chat_type="private"):
-    if chat_type in ["group", "supergroup"]:
-        return None
-    if state == "idle":
-        action_text = BEGIN_TEXT
-    elif state == "searching":
-        action_text = STOP_SEARCHING_TEXT
-    elif state == "chatting":
-        action_text = END_CHAT_TEXT
-    else:
-        action_text = BEGIN_TEXT
-    return ReplyKeyboardMarkup(
-        keyboard=[
-            [KeyboardButton(text=action_text), KeyboardButton(text="⚙️ Setup")],
-            [KeyboardButton(text="❓ Help")],
-        ],
-        resize_keyboard=True
-    )
+    return keyboards.main_keyboard(state, chat_type)
 
 # Define the Inline Keyboard for Setup options
 def get_setup_inline_keyboard():
-    return InlineKeyboardMarkup(
-        inline_keyboard=[
-            [InlineKeyboardButton(text="Your profile", callback_data="your_setup")],
-            [InlineKeyboardButton(text="Partner Profile", callback_data="partner_setup")],
-            [InlineKeyboardButton(text="Show Profile", callback_data="show_setup")],
-        ]
-    )
+    return keyboards.SETUP_MENU
 
 # Define the /start command with membership check
 @router.message(F.chat.type == "private", F.text == "/start")
@@ -198,7 +399,7 @@ async def start_command(message: Message):
     if not await is_group_member(user_id):
         await send_join_group_message(message)
         return
-    current_state = get_user_state(user_id)
+    current_state = await get_user_state(user_id)
     welcome_text = "👋 Welcome to our matchmaking bot! Discover your perfect match based on your preferences.\n"
     if current_state == "idle":
         welcome_text += "Press 'Setup' to configure your preferences."
@@ -214,7 +415,7 @@ async def start_command(message: Message):
         await show_setup_menu(message)
 
 # Handle "Setup" button or command
-@router.message(F.chat.type == "private", F.text.in_({"⚙️ Setup", "/setup"}))
+@router.message(F.chat.type == "private", F.text.in_({SETUP_TEXT, "/setup"}))
 async def handle_setup(message: Message):
     await show_setup_menu(message)
 
@@ -234,187 +435,256 @@ async def show_setup_menu(message_or_callback):
 # Handle "Your Setup" inline button
 @router.callback_query(F.data == "your_setup")
 async def handle_your_setup(callback: CallbackQuery):
-    inline_keyboard = InlineKeyboardMarkup(
-        inline_keyboard=[
-            [InlineKeyboardButton(text="Age", callback_data="age")],
-            [InlineKeyboardButton(text="Gender", callback_data="gender")],
-            [InlineKeyboardButton(text="Religion", callback_data="religion")],
-            [InlineKeyboardButton(text="⬅️ Back", callback_data="setup")],
-        ]
-    )
     await callback.message.edit_text(
         text="🔧 You selected 'Your Setup'. Choose an option below to configure:",
-        reply_markup=inline_keyboard
+        reply_markup=keyboards.YOUR_SETUP_MENU
     )
     await callback.answer()
 
 # Handle "Partner Setup" inline button
 @router.callback_query(F.data == "partner_setup")
 async def handle_partner_setup(callback: CallbackQuery):
-    partner_setup_keyboard = InlineKeyboardMarkup(
-        inline_keyboard=[
-            [InlineKeyboardButton(text="Age", callback_data="partner_age")],
-            [InlineKeyboardButton(text="Gender", callback_data="partner_gender")],
-            [InlineKeyboardButton(text="Religion", callback_data="partner_religion")],
-            [InlineKeyboardButton(text="⬅️ Back", callback_data="setup")],
-        ]
-    )
     await callback.message.edit_text(
         text="🤝 You selected 'Partner Setup'. Configure partner preferences below:",
-        reply_markup=partner_setup_keyboard
+        reply_markup=keyboards.PARTNER_SETUP_MENU
     )
     await callback.answer()
 
 # Handle "Back to Setup" inline button
 @router.callback_query(F.data == "setup")
 async def handle_back_to_setup(callback: CallbackQuery):
-    await callback.message.edit_text(
+    await edit_to_setup_menu(callback.message)
+    await callback.answer()
+
+async def edit_to_setup_menu(message: Message):
+    await message.edit_text(
         text="⚙️ Please choose your setup option:",
         reply_markup=get_setup_inline_keyboard()
     )
-    await callback.answer()
+
+# Show the setup menu again after the confirmation has been on screen for a few
+# seconds, unless the user has moved on by then. The callback has already been
+# answered, so this only edits the message.
+def return_to_setup_later(callback: CallbackQuery):
+    delayed_actions.schedule(callback.from_user.id, 5, lambda: edit_to_setup_menu(callback.message))
 
 # Function to start searching with setup check
 async def start_searching(message: Message, user_id: int):
-    is_complete, missing_fields = is_setup_complete(user_id)
-    if not is_complete:
+    if not is_setup_complete(user_id):
         await message.answer(
-            text=f"⚠️ Please complete your setup before starting a match. Missing fields:\n- {', '.join(missing_fields)}\nRedirecting to setup menu...",
+            text=f"⚠️ Please complete your setup before starting a match. Missing fields:\n- {', '.join(missing_setup_fields(user_id))}\nRedirecting to setup menu...",
             reply_markup=get_main_keyboard(state="idle")
         )
+        searches_rejected.inc()
         await show_setup_menu(message)
         return False
-    waiting_start_times[user_id] = datetime.datetime.now()
-    waiting_users.add(user_id)
+    if STATE_BACKEND == "mongodb":
+        await save_user_now(user_id)
+    await state_backend.join_queue(user_id, user_data[user_id])
+    searches_started.inc()
     await message.answer(
         "🔍 Waiting for a partner. ",
         reply_markup=get_main_keyboard(state="searching")
     )
-    await attempt_match(user_id)
+    await request_match(user_id)
     return True
 
-# Modified to prioritize users waiting longer and handle "Any" religion explicitly
-def find_match(user_id):
+# Looks up the longest-waiting compatible partner not on cooldown with the user
+async def find_match(user_id):
     if user_id not in user_data:
         return None
-    now = datetime.datetime.now()
-    user_prefs = user_data[user_id]
-    sorted_waiting_users = sorted(
-        waiting_users,
-        key=lambda x: waiting_start_times.get(x, now)
+    now = int(time.time())
+    return await state_backend.find_match(
+        user_id,
+        user_data[user_id],
+        lambda candidate_id: cooldowns.is_active(user_id, candidate_id, now)
     )
-    for candidate_id in sorted_waiting_users:
-        if candidate_id == user_id or candidate_id in active_matches:
-            continue
-        candidate_prefs = user_data.get(candidate_id, {})
-        if not candidate_prefs:
-            continue
-        if user_id in cooldown_tracker and candidate_id in cooldown_tracker[user_id]:
-            cooldown_end = cooldown_tracker[user_id][candidate_id]
-            if now < cooldown_end:
-                continue
-        partner_criteria = candidate_prefs.get("partner", {})
-        user_partner_prefs = user_prefs.get("partner", {})
-        user_religion = user_prefs.get("religion", "Not set")
-        candidate_religion = candidate_prefs.get("religion", "Not set")
-        partner_religion_pref = partner_criteria.get("religion", "any")
-        user_partner_religion_pref = user_prefs.get("partner", {}).get("religion", "any")
-        candidate_religion_ok = (
-            partner_religion_pref.lower() == "any" or
-            partner_religion_pref == user_religion
-        )
-        user_religion_ok = (
-            user_partner_religion_pref.lower() == "any" or
-            user_partner_religion_pref == candidate_religion
-        )
-        if (
-            (partner_criteria.get("min_age", 0) <= int(user_prefs.get("age", 0)) <= partner_criteria.get("max_age", 100))
-            and (user_partner_prefs.get("min_age", 0) <= int(candidate_prefs.get("age", 0)) <= user_partner_prefs.get("max_age", 100))
-            and (partner_criteria.get("gender", "any") in ("any", user_prefs.get("gender", "any")))
-            and (user_partner_prefs.get("gender", "any") in ("any", candidate_prefs.get("gender", "any")))
-            and candidate_religion_ok
-            and user_religion_ok
-        ):
-            return candidate_id
-    return None
-
-async def attempt_match(user_id):
-    match_id = find_match(user_id)
-    if match_id:
-        active_matches[user_id] = match_id
-        active_matches[match_id] = user_id
-        waiting_users.discard(user_id)
-        waiting_users.discard(match_id)
-        waiting_start_times.pop(user_id, None)
-        waiting_start_times.pop(match_id, None)
-        user_data_1 = user_data[user_id]
-        user_data_2 = user_data[match_id]
-        user_1_info = await bot.get_chat(user_id)
-        user_2_info = await bot.get_chat(match_id)
-        user_1_name = user_1_info.first_name or user_1_info.username or f"User {user_id}"
-        user_2_name = user_2_info.first_name or user_2_info.username or f"User {match_id}"
-        await bot.send_message(
-            chat_id=user_id,
-            text=(
-                f"🎉 Match found!\n\n"
-                f"👤 Partner’s setup:\n"
-                f"📅 Age: {user_data_2.get('age', 'Not set')}\n"
-                f"🚻 Gender: {user_data_2.get('gender', 'Not set')}\n"
-                f"🙏 Religion: {user_data_2.get('religion', 'Not set')}\n"
-                "You can Start messaging."
-            ),
-            reply_markup=get_main_keyboard(state="chatting"),
-        )
-        await bot.send_message(
-            chat_id=match_id,
-            text=(
-                f"🎉 Match found!\n\n"
-                f"👤 Partner’s setup:\n"
-                f"📅 Age: {user_data_1.get('age', 'Not set')}\n"
-                f"🚻 Gender: {user_data_1.get('gender', 'Not set')}\n"
-                f"🙏 Religion: {user_data_1.get('religion', 'Not set')}\n"
-                "You Can Start messaging ."
-            ),
-            reply_markup=get_main_keyboard(state="chatting"),
-        )
-        match_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        channel_message = (
-            f"🤝 **New Match** at {match_time}\n\n"
-            f"👤 User 1: {user_1_name} (ID: {user_id})\n"
-            f"  - Age: {user_data_1.get('age', 'Not set')}\n"
-            f"  - Gender: {user_data_1.get('gender', 'Not set')}\n"
-            f"  - Religion: {user_data_1.get('religion', 'Not set')}\n"
-            f"  - Partner Prefs:\n"
-            f"    - Age Range: {user_data_1.get('partner', {}).get('min_age', 'Not set')} to {user_data_1.get('partner', {}).get('max_age', 'Not set')}\n"
-            f"    - Gender: {user_data_1.get('partner', {}).get('gender', 'Not set')}\n"
-            f"    - Religion: {user_data_1.get('partner', {}).get('religion', 'Not set')}\n\n"
-            f"👤 User 2: {user_2_name} (ID: {match_id})\n"
-            f"  - Age: {user_data_2.get('age', 'Not set')}\n"
-            f"  - Gender: {user_data_2.get('gender', 'Not set')}\n"
-            f"  - Religion: {user_data_2.get('religion', 'Not set')}\n"
-            f"  - Partner Prefs:\n"
-            f"    - Age Range: {user_data_2.get('partner', {}).get('min_age', 'Not set')} to {user_data_2.get('partner', {}).get('max_age', 'Not set')}\n"
-            f"    - Gender: {user_data_2.get('partner', {}).get('gender', 'Not set')}\n"
-            f"    - Religion: {user_data_2.get('partner', {}).get('religion', 'Not set')}"
+
+# Callbacks called as hook(user_id, match_id, seconds) with the time from claiming
+# a pair until both users have been sent their "Match found" message
+match_notify_hooks = [lambda user_id, match_id, seconds: match_notify_seconds.observe(seconds)]
+
+# Tasks running off the request path; kept here so they are not garbage collected
+background_tasks = set()
+
+def run_in_background(coroutine):
+    task = asyncio.create_task(coroutine)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+# Tell both users about their match at the same time; the channel log, which
+# needs both display names, is written afterwards in the background. Returns
+# False, with the pair rolled back, if either user could not be reached.
+async def announce_match(user_id, match_id, matched_at=None):
+    matched_at = time.perf_counter() if matched_at is None else matched_at
+    await asyncio.gather(load_user_data(user_id), load_user_data(match_id))
+    missing = [member for member in (user_id, match_id) if member not in user_data]
+    if missing:
+        await release_match(
+            user_id, match_id, missing,
+            [LookupError("profile not found") if member in missing else None for member in (user_id, match_id)]
         )
+        for member in missing:
+            try:
+                await bot.send_message(
+                    chat_id=member,
+                    text="⚠️ Your profile could not be loaded. Please press Begin to search again.",
+                    reply_markup=get_main_keyboard(state="idle")
+                )
+            except Exception as e:
+                logger.warning("⚠️ Could not tell %s their search was stopped: %s", member, e)
+        return False
+    user_data_1 = user_data[user_id]
+    user_data_2 = user_data[match_id]
+    results = await asyncio.gather(
+        notify_match(user_id, user_data_2, "You can Start messaging."),
+        notify_match(match_id, user_data_1, "You Can Start messaging ."),
+        return_exceptions=True
+    )
+    failed = [member for member, result in zip((user_id, match_id), results) if isinstance(result, Exception)]
+    if failed:
+        await release_match(user_id, match_id, failed, results)
+        return False
+    elapsed = time.perf_counter() - matched_at
+    for hook in match_notify_hooks:
+        try:
+            hook(user_id, match_id, elapsed)
+        except Exception:
+            logger.exception("❌ Error in match notify hook")
+    run_in_background(log_match(user_id, match_id, user_data_1, user_data_2))
+    return True
+
+# Roll back a pair that could not be announced to both users: whoever could not
+# be reached, or whose profile could not be loaded, leaves the queue, and the
+# other goes back to waiting in their old place
+async def release_match(user_id, match_id, failed, results):
+    match_rollbacks.inc()
+    for member, result in zip((user_id, match_id), results):
+        if isinstance(result, Exception):
+            logger.warning("⚠️ Could not announce match to %s: %s", member, result)
+    requeue = {member: user_data[member] for member in (user_id, match_id) if member not in failed}
+    if not await state_backend.release_pair(user_id, match_id, requeue):
+        return
+    for member in requeue:
         try:
             await bot.send_message(
-                chat_id=CHANNEL_ID,
-                text=channel_message,
-                parse_mode="Markdown"
+                chat_id=member,
+                text="⚠️ Your partner is no longer available. 🔍 Waiting for a partner.",
+                reply_markup=get_main_keyboard(state="searching")
             )
-            print(f"📢 Match logged to channel {CHANNEL_ID} for users {user_id} and {match_id}")
         except Exception as e:
-            print(f"❌ Error logging match to channel {CHANNEL_ID}: {e}")
-        return True
+            logger.warning("⚠️ Could not tell %s their match was cancelled: %s", member, e)
+
+async def notify_match(user_id, partner_data, closing_text):
+    await bot.send_message(
+        chat_id=user_id,
+        text=(
+            f"🎉 Match found!\n\n"
+            f"👤 Partner’s setup:\n"
+            f"📅 Age: {partner_data.get('age', 'Not set')}\n"
+            f"🚻 Gender: {partner_data.get('gender', 'Not set')}\n"
+            f"🙏 Religion: {partner_data.get('religion', 'Not set')}\n"
+            f"{closing_text}"
+        ),
+        reply_markup=get_main_keyboard(state="chatting"),
+    )
+
+# Write a new match to the channel audit log
+async def log_match(user_id, match_id, user_data_1, user_data_2):
+    try:
+        user_1_name, user_2_name = await asyncio.gather(get_display_name(user_id), get_display_name(match_id))
+    except Exception as e:
+        logger.warning("❌ Error looking up display names for match log: %s", e)
+        user_1_name, user_2_name = str(user_id), str(match_id)
+    match_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    channel_message = (
+        f"🤝 **New Match** at {match_time}\n\n"
+        f"👤 User 1: {user_1_name} (ID: {user_id})\n"
+        f"  - Age: {user_data_1.get('age', 'Not set')}\n"
+        f"  - Gender: {user_data_1.get('gender', 'Not set')}\n"
+        f"  - Religion: {user_data_1.get('religion', 'Not set')}\n"
+        f"  - Partner Prefs:\n"
+        f"    - Age Range: {user_data_1.get('partner.min_age', 'Not set')} to {user_data_1.get('partner.max_age', 'Not set')}\n"
+        f"    - Gender: {user_data_1.get('partner.gender', 'Not set')}\n"
+        f"    - Religion: {user_data_1.get('partner.religion', 'Not set')}\n\n"
+        f"👤 User 2: {user_2_name} (ID: {match_id})\n"
+        f"  - Age: {user_data_2.get('age', 'Not set')}\n"
+        f"  - Gender: {user_data_2.get('gender', 'Not set')}\n"
+        f"  - Religion: {user_data_2.get('religion', 'Not set')}\n"
+        f"  - Partner Prefs:\n"
+        f"    - Age Range: {user_data_2.get('partner.min_age', 'Not set')} to {user_data_2.get('partner.max_age', 'Not set')}\n"
+        f"    - Gender: {user_data_2.get('partner.gender', 'Not set')}\n"
+        f"    - Religion: {user_data_2.get('partner.religion', 'Not set')}"
+    )
+    audit_log.log_text(channel_message)
+
+# Find and claim a partner; retried when another worker claims the candidate first
+async def attempt_match(user_id, attempts=3):
+    match_attempts.inc()
+    with match_attempt_seconds.time():
+        for _ in range(attempts):
+            match_id = await find_match(user_id)
+            if not match_id:
+                return False
+            if await state_backend.claim_pair(user_id, match_id):
+                matches_made.labels("inline").inc()
+                return await announce_match(user_id, match_id, time.perf_counter())
     return False
 
+# Refresh a waiting user's queue entry after a profile change and try to match them
+async def profile_changed(user_id):
+    if STATE_BACKEND == "mongodb":
+        await save_user_now(user_id)
+    if is_setup_complete(user_id) and await state_backend.update_profile(user_id, user_data[user_id]):
+        await request_match(user_id)
+
+# Match a single user from a handler, only used when the batch matching scheduler is disabled
+async def request_match(user_id):
+    if MATCH_INTERVAL <= 0:
+        return await attempt_match(user_id)
+    return False
+
+# Pair the whole waiting pool in one pass, then notify all new pairs together
+async def run_matching_pass():
+    with matching_pass_seconds.time():
+        return await _run_matching_pass()
+
+async def _run_matching_pass():
+    now = int(time.time())
+    pairs = await state_backend.pair_waiting(
+        lambda user_id, candidate_id: cooldowns.is_active(user_id, candidate_id, now)
+    )
+    matches_made.labels("pass").inc(len(pairs))
+    matched_at = time.perf_counter()
+    results = await asyncio.gather(
+        *(announce_match(user_id, match_id, matched_at) for user_id, match_id in pairs),
+        return_exceptions=True
+    )
+    for (user_id, match_id), result in zip(pairs, results):
+        if isinstance(result, Exception):
+            logger.error("❌ Error announcing match between %s and %s: %s", user_id, match_id, result)
+    return len(pairs)
+
+# End a user's chat: the pair goes on cooldown and their reply maps are dropped
+async def end_chat(user_id):
+    match_id = await state_backend.end_pair(user_id)
+    if match_id is None:
+        return None
+    cooldowns.add(user_id, match_id, COOLDOWN_SECONDS)
+    if STATE_BACKEND == "mongodb":
+        # Other workers check cooldowns in MongoDB, so write this one right away
+        await save_cooldowns()
+    message_id_map.pop(user_id, None)
+    message_id_map.pop(match_id, None)
+    return match_id
+
 # Handle matching buttons and commands with membership check for Begin
 @router.message(F.chat.type == "private", F.text.in_({BEGIN_TEXT, STOP_SEARCHING_TEXT, END_CHAT_TEXT, "/begin", "/end"}))
 async def handle_matching_button(message: Message):
     user_id = message.from_user.id
     text = message.text
-    current_state = get_user_state(user_id)
+    current_state = await get_user_state(user_id)
     if text in [BEGIN_TEXT, "/begin"]:
         if current_state != "idle":
             await message.answer(
@@ -433,8 +703,7 @@ async def handle_matching_button(message: Message):
                 reply_markup=get_main_keyboard(state=current_state)
             )
             return
-        waiting_users.remove(user_id)
-        waiting_start_times.pop(user_id, None)
+        await state_backend.leave_queue(user_id)
         await message.answer(
             "🛑 You have stopped searching.",
             reply_markup=get_main_keyboard(state="idle")
@@ -446,45 +715,32 @@ async def handle_matching_button(message: Message):
                 reply_markup=get_main_keyboard(state=current_state)
             )
             return
-        match_id = active_matches.pop(user_id)
-        active_matches.pop(match_id, None)
-        cooldown_period = datetime.timedelta(hours=4)
-        now = datetime.datetime.now()
-        cooldown_tracker.setdefault(user_id, {})[match_id] = now + cooldown_period
-        cooldown_tracker.setdefault(match_id, {})[user_id] = now + cooldown_period
-        message_id_map.pop(user_id, None)
-        message_id_map.pop(match_id, None)
+        match_id = await end_chat(user_id)
         await message.answer(
             "❌ You have ended the session. You can 'Begin' again to find a new partner.",
             reply_markup=get_main_keyboard(state="idle")
         )
-        await bot.send_message(
-            chat_id=match_id,
-            text="❌ Your partner has ended the session. You can 'Begin' again to find a new partner.",
-            reply_markup=get_main_keyboard(state="idle")
-        )
+        if match_id is not None:
+            await bot.send_message(
+                chat_id=match_id,
+                text="❌ Your partner has ended the session. You can 'Begin' again to find a new partner.",
+                reply_markup=get_main_keyboard(state="idle")
+            )
     elif text == "/end":
         if current_state == "chatting":
-            match_id = active_matches.pop(user_id)
-            active_matches.pop(match_id, None)
-            cooldown_period = datetime.timedelta(hours=4)
-            now = datetime.datetime.now()
-            cooldown_tracker.setdefault(user_id, {})[match_id] = now + cooldown_period
-            cooldown_tracker.setdefault(match_id, {})[user_id] = now + cooldown_period
-            message_id_map.pop(user_id, None)
-            message_id_map.pop(match_id, None)
+            match_id = await end_chat(user_id)
             await message.answer(
                 "❌ You have ended the session. You can 'Begin' again to find a new partner.",
                 reply_markup=get_main_keyboard(state="idle")
             )
-            await bot.send_message(
-                chat_id=match_id,
-                text="❌ Your partner has ended the session. You can 'Begin' again to find a new partner.",
-                reply_markup=get_main_keyboard(state="idle")
-            )
+            if match_id is not None:
+                await bot.send_message(
+                    chat_id=match_id,
+                    text="❌ Your partner has ended the session. You can 'Begin' again to find a new partner.",
+                    reply_markup=get_main_keyboard(state="idle")
+                )
         elif current_state == "searching":
-            waiting_users.remove(user_id)
-            waiting_start_times.pop(user_id, None)
+            await state_backend.leave_queue(user_id)
             await message.answer(
                 "🛑 You have stopped searching.",
                 reply_markup=get_main_keyboard(state="idle")
@@ -496,7 +752,7 @@ async def handle_matching_button(message: Message):
             )
 
 # Handle "Help" button or command
-@router.message(F.chat.type == "private", F.text.in_({"❓ Help", "/help"}))
+@router.message(F.chat.type == "private", F.text.in_({HELP_TEXT, "/help"}))
 async def handle_help(message: Message):
     await message.answer(
         text=(
@@ -510,218 +766,98 @@ async def handle_help(message: Message):
         )
     )
 
+# Debug-level summary of the matchmaking state; callers check isEnabledFor(DEBUG) first
+def log_state_dump():
+    if STATE_BACKEND == "memory":
+        logger.debug(
+            "🗂️ State: %d waiting, %d chatting, %d reply maps",
+            len(state_backend.waiting_users), len(state_backend.active_matches), len(message_id_map)
+        )
+    logger.debug(
+        "🗂️ Caches: %d profiles, %d pending profile writes, %d cooldowns, %d audit log entries queued",
+        len(user_data), len(user_store), len(cooldowns), len(audit_log)
+    )
+
 @router.message(F.chat.type == "private", F.text | F.document | F.photo | F.video | F.audio | F.voice | F.video_note | F.sticker)
 async def forward_messages(message: Message):
+    if message.media_group_id:
+        # Album items arrive one by one; they are relayed together once the album is complete
+        media_groups.add(message)
+        return
+    # Albums still being collected were sent first, so they are relayed first
+    for album in media_groups.take(message.chat.id):
+        await relay_to_partner(album)
+    await relay_to_partner([message])
+
+# Relay one message, or all items of one album, to the sender's chat partner
+async def relay_to_partner(messages):
+    relay_started = time.perf_counter()
+    message = messages[0]
     user_id = message.from_user.id
-    print(f"📩 Received message from {user_id}, type: {message.content_type}")
-    print(f"📋 Active matches: {active_matches}")
-    print(f"🗂️ Current message_id_map: {message_id_map}")
-    if user_id not in active_matches:
-        print(f"⚠️ User {user_id} not in active_matches")
+    logger.debug("📩 Received %d message(s) from %s, type: %s", len(messages), user_id, message.content_type)
+    partner_id = await state_backend.get_partner(user_id)
+    if partner_id is None:
+        logger.debug("⚠️ User %s is not in an active chat", user_id)
         await message.answer(
             "⚠️ You are not currently chatting with anyone. Press 'Begin' to find a partner.",
             reply_markup=get_main_keyboard(state="idle")
         )
         return
-    partner_id = active_matches[user_id]
-    message_id_map.setdefault(user_id, {})
-    message_id_map.setdefault(partner_id, {})
-    sender_gender = user_data.get(user_id, {}).get("gender", "Not set")
+    user_message_map = get_message_map(user_id, partner_id)
+    partner_message_map = get_message_map(partner_id, user_id)
+    sender_gender = user_data.get(user_id, Profile()).get("gender", "Not set")
     gender_emoji = get_gender_emoji(sender_gender)
     label = f"Partner {gender_emoji}: "
     reply_to_message_id = None
     reply_info = ""
     if message.reply_to_message:
         original_reply_id = message.reply_to_message.message_id
-        print(f"↩️ Detected reply from {user_id} to message {original_reply_id}")
-        reply_to_message_id = message_id_map.get(user_id, {}).get(original_reply_id)
+        logger.debug("↩️ Detected reply from %s to message %s", user_id, original_reply_id)
+        reply_to_message_id = user_message_map.get(original_reply_id)
         if not reply_to_message_id:
-            print(f"⚠️ No mapped message ID found for reply from {user_id} to message {original_reply_id}")
+            logger.debug("⚠️ No mapped message ID found for reply from %s to message %s", user_id, original_reply_id)
             reply_info = f" (Reply to message ID {original_reply_id}, mapping not found)"
         else:
-            print(f"✅ Found mapped reply_to_message_id: {reply_to_message_id} for user {user_id}")
+            logger.debug("✅ Found mapped reply_to_message_id: %s for user %s", reply_to_message_id, user_id)
             reply_info = f" (Reply to message ID {reply_to_message_id})"
-    user_info = await bot.get_chat(user_id)
-    sender_name = user_info.first_name or user_info.username or f"User {user_id}"
-    message_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    channel_message = f"💬 **Message** at {message_time}\n👤 From: {sender_name} (ID: {user_id}) to User ID: {partner_id}{reply_info}\n"
     try:
-        forwarded_message = None
-        if message.text:
-            print(f"📝 Forwarding text message from {user_id} to {partner_id}")
-            modified_text = label + message.text
-            forwarded_message = await bot.send_message(
-                chat_id=partner_id,
-                text=modified_text,
-                reply_to_message_id=reply_to_message_id,
-                protect_content=True
-            )
-            channel_message += f"📜 Text: {message.text}\n"
-        elif message.photo:
-            print(f"📸 Forwarding photo from {user_id} to {partner_id}")
-            caption = message.caption or ""
-            modified_caption = label + caption
-            forwarded_message = await bot.send_photo(
-                chat_id=partner_id,
-                photo=message.photo[-1].file_id,
-                caption=modified_caption,
-                reply_to_message_id=reply_to_message_id,
-                protect_content=True
-            )
-            channel_message += f"🖼️ Photo sent\n"
-            if message.caption:
-                channel_message += f"📝 Caption: {message.caption}\n"
-        elif message.document:
-            print(f"📄 Forwarding document from {user_id} to {partner_id}")
-            caption = message.caption or ""
-            modified_caption = label + caption
-            forwarded_message = await bot.send_document(
-                chat_id=partner_id,
-                document=message.document.file_id,
-                caption=modified_caption,
-                reply_to_message_id=reply_to_message_id,
-                protect_content=True
-            )
-            channel_message += f"📎 Document: {message.document.file_name or 'Unnamed document'}\n"
-        elif message.video:
-            print(f"🎥 Forwarding video from {user_id} to {partner_id}")
-            caption = message.caption or ""
-            modified_caption = label + caption
-            forwarded_message = await bot.send_video(
-                chat_id=partner_id,
-                video=message.video.file_id,
-                caption=modified_caption,
-                reply_to_message_id=reply_to_message_id,
-                protect_content=True
-            )
-            channel_message += f"🎥 Video sent\n"
-            if message.caption:
-                channel_message += f"📝 Caption: {message.caption}\n"
-        elif message.audio:
-            print(f"🎵 Forwarding audio from {user_id} to {partner_id}")
-            caption = message.caption or ""
-            modified_caption = label + caption
-            forwarded_message = await bot.send_audio(
-                chat_id=partner_id,
-                audio=message.audio.file_id,
-                caption=modified_caption,
-                reply_to_message_id=reply_to_message_id,
-                protect_content=True
-            )
-            channel_message += f"🎵 Audio sent\n"
-            if message.caption:
-                channel_message += f"📝 Caption: {message.caption}\n"
-        elif message.voice:
-            print(f"🎙️ Forwarding voice message from {user_id} to {partner_id}")
-            caption = message.caption or ""
-            modified_caption = label + caption
-            forwarded_message = await bot.send_voice(
-                chat_id=partner_id,
-                voice=message.voice.file_id,
-                caption=modified_caption,
-                reply_to_message_id=reply_to_message_id,
-                protect_content=True
-            )
-            channel_message += f"🎙️ Voice message sent\n"
-            if message.caption:
-                channel_message += f"📝 Caption: {message.caption}\n"
-        elif message.video_note:
-            print(f"🎥 Forwarding video note from {user_id} to {partner_id}")
-            label_text = f"Partner {gender_emoji}:"
-            await bot.send_message(
-                chat_id=partner_id,
-                text=label_text,
-                reply_to_message_id=reply_to_message_id,
-                protect_content=True
-            )
-            forwarded_message = await bot.send_video_note(
-                chat_id=partner_id,
-                video_note=message.video_note.file_id,
-                reply_to_message_id=reply_to_message_id,
-                protect_content=True
-            )
-            message_id_map[user_id][message.message_id] = forwarded_message.message_id
-            message_id_map[partner_id][forwarded_message.message_id] = message.message_id
-            print(f"📌 Mapped message ID {message.message_id} (user {user_id}) to {forwarded_message.message_id} (user {partner_id}) for video note")
-            channel_message += f"📜 Label: {label_text}\n🎥 Video note sent\n"
-        elif message.sticker:
-            print(f"🏷️ Forwarding sticker from {user_id} to {partner_id}")
-            label_text = f"Partner {gender_emoji}:"
-            await bot.send_message(
-                chat_id=partner_id,
-                text=label_text,
-                reply_to_message_id=reply_to_message_id,
-                protect_content=True
-            )
-            forwarded_message = await bot.send_sticker(
-                chat_id=partner_id,
-                sticker=message.sticker.file_id,
-                reply_to_message_id=reply_to_message_id,
-                protect_content=True
-            )
-            message_id_map[user_id][message.message_id] = forwarded_message.message_id
-            message_id_map[partner_id][forwarded_message.message_id] = message.message_id
-            print(f"📌 Mapped message ID {message.message_id} (user {user_id}) to {forwarded_message.message_id} (user {partner_id}) for sticker")
-            channel_message += f"📜 Label: {label_text}\n🏷️ Sticker sent\n"
-        if forwarded_message and hasattr(forwarded_message, 'message_id') and message.content_type not in ('video_note', 'sticker'):
-            message_id_map[user_id][message.message_id] = forwarded_message.message_id
-            message_id_map[partner_id][forwarded_message.message_id] = message.message_id
-            print(f"📌 Mapped message ID {message.message_id} (user {user_id}) to {forwarded_message.message_id} (user {partner_id})")
+        if can_relay_as_album(messages):
+            relayed_ids = await relay_album(bot, messages, partner_id, label, reply_to_message_id)
         else:
-            print(f"⚠️ Failed to map message ID for {user_id}: No valid forwarded_message")
+            relayed_ids = [
+                await relay_message(bot, item, partner_id, label, reply_to_message_id)
+                for item in messages
+            ]
+        for item, relayed_id in zip(messages, relayed_ids):
+            user_message_map[item.message_id] = relayed_id
+            partner_message_map[relayed_id] = item.message_id
+            logger.debug("📌 Mapped message ID %s (user %s) to %s (user %s)", item.message_id, user_id, relayed_id, partner_id)
     except Exception as e:
-        print(f"❌ Error forwarding message from {user_id} to {partner_id}: {e}")
+        relay_errors.inc()
+        logger.error("❌ Error forwarding message from %s to %s: %s", user_id, partner_id, e)
         await message.answer("⚠️ Failed to send message. Please try again.")
+    else:
+        messages_relayed.labels(message.content_type).inc(len(messages))
+        relay_seconds.observe(time.perf_counter() - relay_started)
 
-    try:
-        await bot.send_message(
-            chat_id=CHANNEL_ID,
-            text=channel_message,
-            parse_mode="Markdown"
-        )
-        if message.photo:
-            await bot.send_photo(
-                chat_id=CHANNEL_ID,
-                photo=message.photo[-1].file_id,
-                caption=message.caption or ""
-            )
-        elif message.document:
-            await bot.send_document(
-                chat_id=CHANNEL_ID,
-                document=message.document.file_id,
-                caption=message.caption or ""
-            )
-        elif message.video:
-            await bot.send_video(
-                chat_id=CHANNEL_ID,
-                video=message.video.file_id,
-                caption=message.caption or ""
-            )
-        elif message.audio:
-            await bot.send_audio(
-                chat_id=CHANNEL_ID,
-                audio=message.audio.file_id,
-                caption=message.caption or ""
-            )
-        elif message.voice:
-            await bot.send_voice(
-                chat_id=CHANNEL_ID,
-                voice=message.voice.file_id,
-                caption=message.caption or ""
-            )
-        elif message.video_note:
-            await bot.send_video_note(
-                chat_id=CHANNEL_ID,
-                video_note=message.video_note.file_id
-            )
-        elif message.sticker:
-            await bot.send_sticker(
-                chat_id=CHANNEL_ID,
-                sticker=message.sticker.file_id
-            )
-        print(f"📢 Message logged to channel {CHANNEL_ID} from user {user_id} to {partner_id}")
-    except Exception as e:
-        print(f"❌ Error logging message to channel {CHANNEL_ID}: {e}")
+    sender_name = await get_display_name(user_id)
+    message_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    channel_message = f"💬 **Message** at {message_time}\n👤 From: {sender_name} (ID: {user_id}) to User ID: {partner_id}{reply_info}\n"
+    channel_message += "".join(describe_message(item, label) for item in messages)
+    audit_log.log_text(channel_message)
+    # Media is re-sent by file_id, which keeps working after the sender deletes the message
+    if can_relay_as_album(messages):
+        audit_log.log_media("send_media_group", media=archive_album(messages))
+    else:
+        for item in messages:
+            call = archive_call(item)
+            if call is not None:
+                audit_log.log_media(call[0], **call[1])
+    if logger.isEnabledFor(logging.DEBUG):
+        log_state_dump()
+
+# Albums are relayed while holding the sender's lock, in order with their other messages
+media_groups = MediaGroupCollector(relay_to_partner, hold=user_locks.hold)
 
 # Optional: Explicitly ignore messages in group chats
 @router.message(F.chat.type.in_({"group", "supergroup"}))
@@ -739,210 +875,66 @@ async def set_bot_commands():
         BotCommand(command="group", description="View group information and options")
     ]
     await bot.set_my_commands(commands, scope=BotCommandScopeAllPrivateChats())
-    print("✅ Bot commands set for private chats only")
-
-# Callback query handlers
-@router.callback_query(F.data == "age")
-async def handle_age(callback: CallbackQuery):
-    age_keyboard = InlineKeyboardMarkup(
-        inline_keyboard=[
-            [InlineKeyboardButton(text=str(age), callback_data=f"selected_age_{age}") for age in range(row_start, row_start + 5)]
-            for row_start in range(18, 100, 5)
-        ]
-    )
-    age_keyboard.inline_keyboard.append([InlineKeyboardButton(text="⬅️ Back", callback_data="your_setup")])
-    await callback.message.edit_text(text="📅 Select your age:", reply_markup=age_keyboard)
-    await callback.answer()
-
-@router.callback_query(F.data == "gender")
-async def handle_gender(callback: CallbackQuery):
-    gender_keyboard = InlineKeyboardMarkup(
-        inline_keyboard=[
-            [InlineKeyboardButton(text="Male 🧑🏽‍🦱", callback_data="selected_gender_male")],
-            [InlineKeyboardButton(text="Female 👩🏽‍🦰", callback_data="selected_gender_female")],
-            [InlineKeyboardButton(text="⬅️ Back", callback_data="your_setup")],
-        ]
-    )
-    await callback.message.edit_text(text="🚻 Please indicate your Gender:", reply_markup=gender_keyboard)
-    await callback.answer()
+    logger.info("✅ Bot commands set for private chats only")
 
-@router.callback_query(F.data == "religion")
-async def handle_religion(callback: CallbackQuery):
-    religion_keyboard = InlineKeyboardMarkup(
-        inline_keyboard=[
-            [InlineKeyboardButton(text="Orthodox", callback_data="selected_religion_orthodox")],
-            [InlineKeyboardButton(text="Muslim", callback_data="selected_religion_muslim")],
-            [InlineKeyboardButton(text="Protestant", callback_data="selected_religion_protestant")],
-            [InlineKeyboardButton(text="⬅️ Back", callback_data="your_setup")],
-        ]
-    )
-    await callback.message.edit_text(text="🙏 Please select your religion:", reply_markup=religion_keyboard)
-    await callback.answer()
+# Profile setup wizard; see setup_wizard.STEPS for the fields and their order
+setup_wizard = SetupWizard(STEPS)
+# Seconds to wait before re-checking the match of a user who left the wizard early
+SETUP_SETTLE_DELAY = 30
 
-@router.callback_query(F.data.startswith("selected_age_"))
-async def handle_age_selection(callback: CallbackQuery):
-    user_id = callback.from_user.id
-    selected_age = callback.data.split("_")[-1]
-    if user_id not in user_data:
-        user_data[user_id] = {}
-    user_data[user_id]["age"] = selected_age
-    update_user_data_now(user_id)
-    await callback.answer(text=f"Your age is {selected_age}", show_alert=True)
-    if user_id in waiting_users and is_setup_complete(user_id)[0]:
-        await attempt_match(user_id)
-    await handle_gender(callback)
-
-@router.callback_query(F.data.startswith("selected_gender_"))
-async def handle_gender_selection(callback: CallbackQuery):
-    user_id = callback.from_user.id
-    selected_gender = callback.data.split("_")[-1]
-    if user_id not in user_data:
-        user_data[user_id] = {}
-    user_data[user_id]["gender"] = selected_gender
-    update_user_data_now(user_id)
-    await callback.answer(text=f"You selected {selected_gender}", show_alert=True)
-    if user_id in waiting_users and is_setup_complete(user_id)[0]:
-        await attempt_match(user_id)
-    await handle_religion(callback)
-
-@router.callback_query(F.data.startswith("selected_religion_"))
-async def handle_religion_selection(callback: CallbackQuery):
-    user_id = callback.from_user.id
-    selected_religion = callback.data.split("_")[-1].replace("_", " ").capitalize()
-    if user_id not in user_data:
-        user_data[user_id] = {}
-    user_data[user_id]["religion"] = selected_religion
-    update_user_data_now(user_id)
-    selected_age = user_data[user_id].get("age", "Not set")
-    selected_gender = user_data[user_id].get("gender", "Not set")
-    selected_religion = user_data[user_id].get("religion", "Not set")
+# Show the screen of one setup wizard step
+async def show_setup_step(callback: CallbackQuery, step):
+    profile = user_data.get(callback.from_user.id, Profile())
     await callback.message.edit_text(
-        text=(
-            f"🎉 Your selections are confirmed:\n"
-            f"- 📅 Age: {selected_age}\n"
-            f"- 🚻 Gender: {selected_gender}\n"
-            f"- 🙏 Religion: {selected_religion}\n\n"
-            "Returning to the Setup menu..."
-        )
-    )
-    if user_id in waiting_users and is_setup_complete(user_id)[0]:
-        await attempt_match(user_id)
-    await asyncio.sleep(5)
-    await handle_back_to_setup(callback)
-
-@router.callback_query(F.data == "partner_age")
-async def handle_partner_minimum_age(callback: CallbackQuery):
-    age_keyboard = InlineKeyboardMarkup(
-        inline_keyboard=[
-            [InlineKeyboardButton(text=str(age), callback_data=f"partner_min_age_{age}") for age in range(row_start, row_start + 5)]
-            for row_start in range(18, 100, 5)
-        ]
+        text=step.prompt(profile) if callable(step.prompt) else step.prompt,
+        reply_markup=step.keyboard(profile) if callable(step.keyboard) else step.keyboard
     )
-    age_keyboard.inline_keyboard.append([InlineKeyboardButton(text="⬅️ Back", callback_data="partner_setup")])
-    await callback.message.edit_text(text="📅 Select the **minimum age** for the partner:", reply_markup=age_keyboard)
-    await callback.answer()
 
-@router.callback_query(F.data.startswith("partner_min_age_"))
-async def handle_partner_maximum_age(callback: CallbackQuery):
-    user_id = callback.from_user.id
-    min_age = int(callback.data.split("_")[-1])
-    user_data.setdefault(user_id, {}).setdefault("partner", {})["min_age"] = min_age
-    update_user_data_now(user_id)
-    if user_id in waiting_users and is_setup_complete(user_id)[0]:
-        await attempt_match(user_id)
-    max_age_keyboard = InlineKeyboardMarkup(
-        inline_keyboard=[
-            [InlineKeyboardButton(text=str(age), callback_data=f"partner_max_age_{age}") for age in range(row_start, row_start + 5) if age >= min_age]
-            for row_start in range(18, 100, 5)
-        ]
-    )
-    max_age_keyboard.inline_keyboard.append([InlineKeyboardButton(text="⬅️ Back", callback_data="partner_age")])
-    await callback.message.edit_text(text=f"📅 Selected minimum age: **{min_age}**\nNow, select the **maximum age** for the partner:", reply_markup=max_age_keyboard)
-    await callback.answer()
+# Re-check a user's place in the queue after their profile changed mid-wizard.
+# The profile may have been evicted from the cache while the timer ran.
+async def settle_setup_changes(user_id):
+    async with user_locks.hold(user_id):
+        await load_user_data(user_id)
+        if user_id not in user_data:
+            return
+        await profile_changed(user_id)
 
-@router.callback_query(F.data.startswith("partner_max_age_"))
-async def handle_partner_age_range(callback: CallbackQuery):
+# Every setup wizard button: either opens a step or chooses a value for it.
+# Each value is applied to the profile and queued for the next bulk write right
+# away. The match re-check runs once when the wizard ends, or SETUP_SETTLE_DELAY
+# seconds after the last value if the user leaves the wizard before its end.
+@router.callback_query(setup_wizard.route)
+async def handle_setup_wizard(callback: CallbackQuery, step, value):
     user_id = callback.from_user.id
-    max_age = int(callback.data.split("_")[-1])
-    min_age = user_data[user_id]["partner"].get("min_age", None)
-    if min_age is None:
-        await callback.message.answer("❌ Minimum age not set. Please start from minimum age selection.")
+    if value is None:
+        await show_setup_step(callback, step)
+        await callback.answer()
         return
-    user_data[user_id]["partner"]["max_age"] = max_age
-    update_user_data_now(user_id)
-    await callback.answer(text=f"🎉 Partner age range set: From {min_age} to {max_age}", show_alert=True)
-    if user_id in waiting_users and is_setup_complete(user_id)[0]:
-        await attempt_match(user_id)
-    await handle_partner_gender(callback)
-
-@router.callback_query(F.data == "partner_gender")
-async def handle_partner_gender(callback: CallbackQuery):
-    gender_keyboard = InlineKeyboardMarkup(
-        inline_keyboard=[
-            [InlineKeyboardButton(text="Male 🧑🏽‍🦱", callback_data="partner_gender_male")],
-            [InlineKeyboardButton(text="Female 👩🏽‍🦰", callback_data="partner_gender_female")],
-            [InlineKeyboardButton(text="⬅️ Back", callback_data="partner_setup")],
-        ]
-    )
-    await callback.message.edit_text(text="🚻 Please select your partner's gender:", reply_markup=gender_keyboard)
-    await callback.answer()
-
-@router.callback_query(F.data.startswith("partner_gender_"))
-async def handle_partner_gender_selection(callback: CallbackQuery):
-    user_id = callback.from_user.id
-    selected_gender = callback.data.split("_")[-1]
-    if user_id not in user_data:
-        user_data[user_id] = {}
-    if "partner" not in user_data[user_id]:
-        user_data[user_id]["partner"] = {}
-    user_data[user_id]["partner"]["gender"] = selected_gender
-    update_user_data_now(user_id)
-    await callback.answer(text=f"🎉 Partner's Gender set to: {selected_gender.capitalize()}", show_alert=True)
-    if user_id in waiting_users and is_setup_complete(user_id)[0]:
-        await attempt_match(user_id)
-    await handle_partner_religion(callback)
-
-@router.callback_query(F.data == "partner_religion")
-async def handle_partner_religion(callback: CallbackQuery):
-    religion_keyboard = InlineKeyboardMarkup(
-        inline_keyboard=[
-            [InlineKeyboardButton(text="Orthodox", callback_data="partner_religion_orthodox")],
-            [InlineKeyboardButton(text="Muslim", callback_data="partner_religion_muslim")],
-            [InlineKeyboardButton(text="Protestant", callback_data="partner_religion_protestant")],
-            [InlineKeyboardButton(text="Any", callback_data="partner_religion_Any")],
-            [InlineKeyboardButton(text="⬅️ Back", callback_data="partner_setup")],
-        ]
-    )
-    await callback.message.edit_text(text="🙏 Please select your partner's religion:", reply_markup=religion_keyboard)
+    value = step.parse(value)
+    if value is None:
+        await callback.answer()
+        return
+    profile = get_profile(user_id)
+    if step.requires is not None and profile.get(step.requires[0]) is None:
+        await callback.message.answer(step.requires[1])
+        await callback.answer()
+        return
+    profile.set(step.field, value)
+    update_user_data(user_id, step.field)
+    track_setup_completeness(user_id)
+    if step.next is not None:
+        if step.alert is not None:
+            await callback.answer(text=step.alert(value, profile), show_alert=True)
+        else:
+            await callback.answer()
+        await show_setup_step(callback, setup_wizard.steps[step.next])
+        delayed_actions.schedule((user_id, "setup"), SETUP_SETTLE_DELAY, lambda: settle_setup_changes(user_id))
+        return
+    delayed_actions.cancel((user_id, "setup"))
+    await callback.message.edit_text(text=step.confirm(profile))
     await callback.answer()
-
-@router.callback_query(F.data.startswith("partner_religion_"))
-async def handle_partner_religion_selection(callback: CallbackQuery):
-    user_id = callback.from_user.id
-    selected_partner_religion = callback.data.split("_")[-1].replace("_", " ").capitalize()
-    if user_id not in user_data:
-        user_data[user_id] = {}
-    if "partner" not in user_data[user_id]:
-        user_data[user_id]["partner"] = {}
-    user_data[user_id]["partner"]["religion"] = selected_partner_religion
-    update_user_data_now(user_id)
-    partner_min_age = user_data[user_id]["partner"].get("min_age", "Not set")
-    partner_max_age = user_data[user_id]["partner"].get("max_age", "Not set")
-    partner_gender = user_data[user_id]["partner"].get("gender", "Not set")
-    partner_religion = user_data[user_id]["partner"].get("religion", "Not set")
-    await callback.message.edit_text(
-        text=(
-            f"🎉 Your partner preferences are confirmed:\n"
-            f"- 📅 Age Range: {partner_min_age} to {partner_max_age}\n"
-            f"- 🚻 Gender: {partner_gender.capitalize()}\n"
-            f"- 🙏 Religion: {partner_religion}\n\n"
-            "Returning to the Setup menu..."
-        )
-    )
-    if user_id in waiting_users and is_setup_complete(user_id)[0]:
-        await attempt_match(user_id)
-    await asyncio.sleep(5)
-    await handle_back_to_setup(callback)
+    await profile_changed(user_id)
+    return_to_setup_later(callback)
 
 @router.callback_query(F.data == "show_setup")
 async def handle_show_setup(callback: CallbackQuery):
@@ -950,13 +942,14 @@ async def handle_show_setup(callback: CallbackQuery):
         await callback.answer(text="⚠️ You are already in the Show Setup menu!", show_alert=True)
         return
     user_id = callback.from_user.id
-    your_age = user_data.get(user_id, {}).get("age", "Not set")
-    your_gender = user_data.get(user_id, {}).get("gender", "Not set")
-    your_religion = user_data.get(user_id, {}).get("religion", "Not set")
-    partner_min_age = user_data.get(user_id, {}).get("partner", {}).get("min_age", "Not set")
-    partner_max_age = user_data.get(user_id, {}).get("partner", {}).get("max_age", "Not set")
-    partner_gender = user_data.get(user_id, {}).get("partner", {}).get("gender", "Not set")
-    partner_religion = user_data.get(user_id, {}).get("partner", {}).get("religion", "Not set")
+    profile = user_data.get(user_id, Profile())
+    your_age = profile.get("age", "Not set")
+    your_gender = profile.get("gender", "Not set")
+    your_religion = profile.get("religion", "Not set")
+    partner_min_age = profile.get("partner.min_age", "Not set")
+    partner_max_age = profile.get("partner.max_age", "Not set")
+    partner_gender = profile.get("partner.gender", "Not set")
+    partner_religion = profile.get("partner.religion", "Not set")
     result_text = (
         f"🛠️ Here is your Profile:\n"
         f"- 📅 Your Age: {your_age}\n"
@@ -973,32 +966,157 @@ async def handle_show_setup(callback: CallbackQuery):
     )
     await callback.answer()
 
+# Function to drop expired cooldowns and write new ones to MongoDB
+async def save_cooldowns():
+    cooldowns.prune()
+    if not PERSIST_COOLDOWNS:
+        return
+    try:
+        await cooldowns.flush()
+    except Exception as e:
+        logger.error("❌ Error saving cooldowns to MongoDB: %s", e)
+
+# Function to restore unexpired cooldowns after a restart
+async def load_cooldowns():
+    if not PERSIST_COOLDOWNS:
+        return
+    try:
+        await cooldowns.ensure_index()
+        await cooldowns.load()
+        logger.info("✅ Restored %d active cooldowns from MongoDB", len(cooldowns))
+    except Exception as e:
+        logger.error("❌ Error loading cooldowns from MongoDB: %s", e)
+
+# Function to write buffered queue and chat events, compacting the journal into a snapshot when it grows
+async def save_session_journal():
+    if STATE_BACKEND != "memory":
+        return
+    try:
+        await state_backend.save_journal(JOURNAL_SNAPSHOT_EVENTS)
+    except Exception as e:
+        logger.error("❌ Error saving session journal to MongoDB: %s", e)
+
+# Function to rebuild the waiting queue and active chats from the journal after a restart
+async def restore_sessions():
+    if STATE_BACKEND != "memory" or state_backend.journal is None:
+        return
+    try:
+        await state_backend.journal.ensure_index()
+        waiting, active_matches = await state_backend.journal.replay()
+        await user_data.load_many(list(waiting) + list(active_matches))
+        for user_id in waiting:
+            track_setup_completeness(user_id)
+        # Only users with a complete profile go back into the waiting queue
+        restored = state_backend.restore(
+            waiting,
+            active_matches,
+            lambda user_id: user_data.get(user_id) if is_setup_complete(user_id) else None
+        )
+        logger.info("✅ Restored %d waiting users and %d active chats from the session journal", restored, len(active_matches) // 2)
+    except Exception as e:
+        logger.error("❌ Error restoring sessions from MongoDB: %s", e)
+
 async def periodic_save():
     while True:
-        await asyncio.sleep(60)
+        await asyncio.sleep(SAVE_INTERVAL)
         await save_user_data()
-        print("🔄 Performed periodic backup of user data")
+        await save_cooldowns()
+        await save_session_journal()
+
+async def periodic_match():
+    while True:
+        await asyncio.sleep(MATCH_INTERVAL)
+        try:
+            matched = await run_matching_pass()
+            if matched:
+                logger.info("🤝 Matching pass paired %d couples", matched)
+        except Exception:
+            logger.exception("❌ Error during matching pass")
+
+# Receive updates with long polling, removing any webhook left from webhook mode
+async def run_polling():
+    async with bot:
+        await bot.delete_webhook()
+        await dp.start_polling(bot)
+
+async def handle_metrics(request):
+    return web.Response(text=metrics.render(), content_type="text/plain", charset="utf-8")
+
+# Serve /metrics on METRICS_HOST:METRICS_PORT; returns the runner to clean up, or None when disabled
+async def start_metrics_server():
+    if METRICS_PORT <= 0:
+        return None
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, METRICS_HOST, METRICS_PORT).start()
+    logger.info("📊 Metrics available at http://%s:%s/metrics", METRICS_HOST, METRICS_PORT)
+    return runner
+
+# Receive updates over HTTP: Telegram posts them to WEBHOOK_PATH with the secret
+# token header, which SimpleRequestHandler checks before feeding the dispatcher
+async def run_webhook():
+    app = web.Application()
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=WEBHOOK_SECRET).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+        await bot.set_webhook(
+            url=f"{WEBHOOK_BASE_URL.rstrip('/')}{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=dp.resolve_used_update_types()
+        )
+        logger.info("🌐 Webhook server listening on %s:%s%s", WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH)
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
 
 async def main():
-    await load_user_data()
-    print("🤖 Bot is running...")
-    print("💾 Individual data points will be saved immediately upon change")
-    print("💾 Automatic backups will occur every minute")
+    log_listener = setup_logging(LOG_LEVEL, LOG_FORMAT)
+    await load_cooldowns()
+    if STATE_BACKEND == "mongodb":
+        await state_backend.ensure_indexes()
+    await restore_sessions()
+    logger.info("🤖 Bot is running...")
+    logger.info("💾 Profile changes are batched and flushed every %gs or every %d changed users", SAVE_INTERVAL, SAVE_BATCH_SIZE)
     await set_bot_commands()
     periodic_save_task = asyncio.create_task(periodic_save())
+    periodic_match_task = asyncio.create_task(periodic_match()) if MATCH_INTERVAL > 0 else None
+    audit_log.start()
+    metrics_runner = await start_metrics_server()
     try:
-        async with bot:
-            await dp.start_polling(bot)
+        if BOT_MODE == "webhook":
+            await run_webhook()
+        else:
+            await run_polling()
     except KeyboardInterrupt:
-        await save_user_data()
-        print("💾 Final save completed before shutdown")
+        pass
     finally:
-        periodic_save_task.cancel()
-        try:
-            await periodic_save_task
-        except asyncio.CancelledError:
-            pass
-        print("👋 Bot has shut down gracefully")
+        for task in (periodic_save_task, periodic_match_task):
+            if task is None:
+                continue
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        await media_groups.flush()
+        await delayed_actions.stop()
+        if background_tasks:
+            await asyncio.gather(*background_tasks, return_exceptions=True)
+        await save_user_data()
+        await save_cooldowns()
+        await save_session_journal()
+        logger.info("💾 Final save completed before shutdown")
+        await audit_log.stop()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await bot.session.close()
+        logger.info("👋 Bot has shut down gracefully")
+        log_listener.stop()
 
 if __name__ == "__main__":
     asyncio.run(main())
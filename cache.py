@@ -0,0 +1,66 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+# Async read-through cache with per-entry expiry. get() calls loader(key) on a
+# miss, and concurrent misses for the same key share a single loader call.
+# ttl is either a number of seconds or a callable returning the TTL for a
+# loaded value, so positive and negative answers can expire at different rates.
+# At most maxsize entries are kept; the oldest are dropped first. A set() or
+# invalidate() during a load wins over the loader's result, which is then
+# returned to its callers but not cached.
+class AsyncTTLCache:
+    def __init__(self, loader, ttl, maxsize=10000):
+        self._loader = loader
+        self._ttl = ttl if callable(ttl) else (lambda value: ttl)
+        self._maxsize = maxsize
+        self._entries = OrderedDict()
+        self._pending = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    # Return a fresh cached value without loading, or default
+    def peek(self, key, default=None):
+        entry = self._entries.get(key)
+        if entry is None:
+            return default
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return default
+        return value
+
+    async def get(self, key):
+        value = self.peek(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        future = self._pending.get(key)
+        if future is not None:
+            return await asyncio.shield(future)
+        future = asyncio.ensure_future(self._loader(key))
+        self._pending[key] = future
+        try:
+            value = await future
+        except BaseException:
+            if self._pending.get(key) is future:
+                del self._pending[key]
+            raise
+        if self._pending.get(key) is future:
+            del self._pending[key]
+            self.set(key, value)
+        return value
+
+    # Store a value known to be current, e.g. taken from an incoming update
+    def set(self, key, value):
+        self._pending.pop(key, None)
+        self._entries.pop(key, None)
+        self._entries[key] = (time.monotonic() + self._ttl(value), value)
+        while len(self._entries) > self._maxsize:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        self._pending.pop(key, None)
+        self._entries.pop(key, None)
@@ -0,0 +1,93 @@
+import datetime
+import heapq
+import time
+from pymongo import UpdateOne
+
+# Symmetric cooldowns between pairs of users who have already chatted. Each
+# pair is stored once under a single integer key with its expiry as integer
+# epoch seconds; a min-heap of expiries lets prune() drop expired pairs without
+# scanning. With a collection, new cooldowns are written by flush() and
+# load() restores the unexpired ones after a restart; ensure_index() creates
+# the TTL index that lets MongoDB delete them once they expire.
+class CooldownStore:
+    def __init__(self, collection=None):
+        self._collection = collection
+        self._expiries = {}
+        self._heap = []
+        self._pending = {}
+
+    def __len__(self):
+        return len(self._expiries)
+
+    @staticmethod
+    def _key(user_id, other_id):
+        low, high = (user_id, other_id) if user_id <= other_id else (other_id, user_id)
+        return (low << 64) | high
+
+    # Put a pair on cooldown for the given number of seconds
+    def add(self, user_id, other_id, seconds, now=None):
+        now = int(time.time()) if now is None else now
+        key = self._key(user_id, other_id)
+        expires_at = now + int(seconds)
+        self._expiries[key] = expires_at
+        heapq.heappush(self._heap, (expires_at, key))
+        if self._collection is not None:
+            self._pending[key] = (user_id, other_id, expires_at)
+        return expires_at
+
+    def is_active(self, user_id, other_id, now=None):
+        expires_at = self._expiries.get(self._key(user_id, other_id))
+        if expires_at is None:
+            return False
+        return (int(time.time()) if now is None else now) < expires_at
+
+    # Drop expired pairs and return how many were removed
+    def prune(self, now=None):
+        now = int(time.time()) if now is None else now
+        removed = 0
+        while self._heap and self._heap[0][0] <= now:
+            expires_at, key = heapq.heappop(self._heap)
+            if self._expiries.get(key) == expires_at:
+                del self._expiries[key]
+                removed += 1
+        return removed
+
+    async def ensure_index(self):
+        await self._collection.create_index("expires_at", expireAfterSeconds=0)
+
+    # Load unexpired cooldowns from MongoDB
+    async def load(self):
+        now = int(time.time())
+        cursor = self._collection.find({'expires_at': {'$gt': datetime.datetime.fromtimestamp(now, datetime.timezone.utc)}})
+        async for document in cursor:
+            user_id, other_id = document['users']
+            expires_at = document['expires_at']
+            if expires_at.tzinfo is None:
+                expires_at = expires_at.replace(tzinfo=datetime.timezone.utc)
+            key = self._key(user_id, other_id)
+            self._expiries[key] = int(expires_at.timestamp())
+            heapq.heappush(self._heap, (self._expiries[key], key))
+
+    # Write cooldowns added since the last flush in one bulk_write
+    async def flush(self):
+        if not self._pending:
+            return 0
+        pending, self._pending = self._pending, {}
+        operations = [
+            UpdateOne(
+                {'_id': f"{min(user_id, other_id)}:{max(user_id, other_id)}"},
+                {'$set': {
+                    'users': [user_id, other_id],
+                    'expires_at': datetime.datetime.fromtimestamp(expires_at, datetime.timezone.utc),
+                }},
+                upsert=True
+            )
+            for user_id, other_id, expires_at in pending.values()
+        ]
+        try:
+            await self._collection.bulk_write(operations, ordered=False)
+        except Exception:
+            for key, value in pending.items():
+                self._pending.setdefault(key, value)
+            raise
+        return len(operations)
@@ -0,0 +1,54 @@
+import asyncio
+import logging
+from aiogram.exceptions import TelegramBadRequest
+
+logger = logging.getLogger(__name__)
+
+# Deferred UI actions, at most one pending per key (a user ID). schedule() only
+# registers a loop.call_later timer, which the event loop keeps in its own
+# timer heap, so nothing is parked while the delay runs; a task is created only
+# when the action is due. Scheduling again for the same key replaces the
+# pending action, and cancel(key) drops it, e.g. when the user navigates
+# elsewhere first.
+class DelayedActions:
+    def __init__(self):
+        self._timers = {}
+        self._tasks = set()
+
+    def __len__(self):
+        return len(self._timers)
+
+    # Run action() (a coroutine function) after delay seconds unless cancelled
+    def schedule(self, key, delay, action):
+        self.cancel(key)
+        self._timers[key] = asyncio.get_running_loop().call_later(delay, self._run, key, action)
+
+    def cancel(self, key):
+        timer = self._timers.pop(key, None)
+        if timer is None:
+            return False
+        timer.cancel()
+        return True
+
+    def _run(self, key, action):
+        self._timers.pop(key, None)
+        task = asyncio.ensure_future(self._call(key, action))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _call(self, key, action):
+        try:
+            await action()
+        except TelegramBadRequest as e:
+            # Expected when the message was deleted or already edited meanwhile
+            logger.debug("Delayed action for %s failed: %s", key, e)
+        except Exception:
+            logger.exception("❌ Delayed action for %s failed", key)
+
+    # Drop every pending action and wait for the ones already running, e.g. at shutdown
+    async def stop(self):
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers.clear()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
@@ -0,0 +1,116 @@
+import functools
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, KeyboardButton, ReplyKeyboardMarkup
+
+# Keyboard registry. Every static markup is built once at import time and the
+# same instance is passed to every answer/edit_text call; parameterized ones are
+# memoized per argument. Markups and their button lists are mutable (pydantic
+# turns tuple rows back into lists), so callers must never modify a shared
+# markup in place.
+
+# Button texts
+BEGIN_TEXT = "🚀 Begin"
+STOP_SEARCHING_TEXT = "⏹️ Stop Searching"
+END_CHAT_TEXT = "🔚 End Chat"
+SETUP_TEXT = "⚙️ Setup"
+HELP_TEXT = "❓ Help"
+
+# Ages offered in the age grids, in rows of five
+AGE_ROWS = range(18, 100, 5)
+
+def _inline(*rows):
+    return InlineKeyboardMarkup(inline_keyboard=[list(row) for row in rows])
+
+def _button(text, callback_data):
+    return InlineKeyboardButton(text=text, callback_data=callback_data)
+
+def _back(callback_data):
+    return [_button("⬅️ Back", callback_data)]
+
+def _age_grid(prefix, back, min_age=0):
+    rows = [
+        [_button(str(age), f"{prefix}{age}") for age in range(row_start, row_start + 5) if age >= min_age]
+        for row_start in AGE_ROWS
+    ]
+    return _inline(*rows, _back(back))
+
+def _main_keyboard(action_text):
+    return ReplyKeyboardMarkup(
+        keyboard=[
+            [KeyboardButton(text=action_text), KeyboardButton(text=SETUP_TEXT)],
+            [KeyboardButton(text=HELP_TEXT)],
+        ],
+        resize_keyboard=True
+    )
+
+MAIN_KEYBOARDS = {
+    "idle": _main_keyboard(BEGIN_TEXT),
+    "searching": _main_keyboard(STOP_SEARCHING_TEXT),
+    "chatting": _main_keyboard(END_CHAT_TEXT),
+}
+
+SETUP_MENU = _inline(
+    [_button("Your profile", "your_setup")],
+    [_button("Partner Profile", "partner_setup")],
+    [_button("Show Profile", "show_setup")],
+)
+
+YOUR_SETUP_MENU = _inline(
+    [_button("Age", "age")],
+    [_button("Gender", "gender")],
+    [_button("Religion", "religion")],
+    _back("setup"),
+)
+
+PARTNER_SETUP_MENU = _inline(
+    [_button("Age", "partner_age")],
+    [_button("Gender", "partner_gender")],
+    [_button("Religion", "partner_religion")],
+    _back("setup"),
+)
+
+AGE_KEYBOARD = _age_grid("selected_age_", "your_setup")
+
+GENDER_KEYBOARD = _inline(
+    [_button("Male 🧑🏽‍🦱", "selected_gender_male")],
+    [_button("Female 👩🏽‍🦰", "selected_gender_female")],
+    _back("your_setup"),
+)
+
+RELIGION_KEYBOARD = _inline(
+    [_button("Orthodox", "selected_religion_orthodox")],
+    [_button("Muslim", "selected_religion_muslim")],
+    [_button("Protestant", "selected_religion_protestant")],
+    _back("your_setup"),
+)
+
+PARTNER_MIN_AGE_KEYBOARD = _age_grid("partner_min_age_", "partner_setup")
+
+PARTNER_GENDER_KEYBOARD = _inline(
+    [_button("Male 🧑🏽‍🦱", "partner_gender_male")],
+    [_button("Female 👩🏽‍🦰", "partner_gender_female")],
+    _back("partner_setup"),
+)
+
+PARTNER_RELIGION_KEYBOARD = _inline(
+    [_button("Orthodox", "partner_religion_orthodox")],
+    [_button("Muslim", "partner_religion_muslim")],
+    [_button("Protestant", "partner_religion_protestant")],
+    [_button("Any", "partner_religion_Any")],
+    _back("partner_setup"),
+)
+
+# Reply keyboard for a user state; group chats get no reply keyboard
+def main_keyboard(state="idle", chat_type="private"):
+    if chat_type in ["group", "supergroup"]:
+        return None
+    return MAIN_KEYBOARDS.get(state, MAIN_KEYBOARDS["idle"])
+
+# Max-age grid offering only ages from min_age up, one markup per minimum age.
+# min_age comes from callback data, so the cache is bounded.
+@functools.lru_cache(maxsize=128)
+def partner_max_age_keyboard(min_age):
+    return _age_grid("partner_max_age_", "partner_age", min_age)
+
+@functools.lru_cache(maxsize=1)
+def join_group_keyboard(invite_link):
+    return _inline([InlineKeyboardButton(text="Join Group", url=invite_link)])
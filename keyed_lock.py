@@ -0,0 +1,32 @@
+import asyncio
+import contextlib
+
+# One asyncio.Lock per key, created on first use and dropped once no task holds
+# or waits for it, so the map only grows with the number of busy keys.
+#
+#     async with user_locks.hold(user_id):
+#         ...
+class KeyedLock:
+    def __init__(self):
+        self._locks = {}
+
+    def __len__(self):
+        return len(self._locks)
+
+    def locked(self, key):
+        entry = self._locks.get(key)
+        return entry is not None and entry[0].locked()
+
+    @contextlib.asynccontextmanager
+    async def hold(self, key):
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
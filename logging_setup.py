@@ -0,0 +1,45 @@
+import json
+import logging
+import logging.handlers
+import queue
+
+TEXT_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+# Attributes every LogRecord has; anything else was passed through extra= and
+# is written as a field of its own by JsonFormatter
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "taskName"}
+
+# One JSON object per line: time, level, logger, message and any extra= fields
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+# Route all logging through a QueueHandler so callers only enqueue the record;
+# a QueueListener thread formats it and writes it to stderr. Messages use lazy
+# %-style arguments, so records below the level are never formatted. Returns
+# the started listener, which must be stopped at shutdown to flush the queue.
+def setup_logging(level="INFO", fmt="text"):
+    if fmt not in ("text", "json"):
+        raise ValueError(f"Unknown LOG_FORMAT {fmt!r}. Use 'text' or 'json'.")
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(JsonFormatter() if fmt == "json" else logging.Formatter(TEXT_FORMAT))
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(level.upper() if isinstance(level, str) else level)
+    listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    listener.start()
+    return listener
@@ -0,0 +1,176 @@
+import heapq
+from bisect import bisect_left, insort
+from itertools import count
+from profiles import GENDER_ANY, GENDERS, RELIGION_ANY, RELIGIONS, Profile
+
+# Compiled view of a waiting user's Profile (raw profile documents are
+# converted first). Gender and religion are integer codes, unset partner
+# preferences mean "any", and the "any" religion check is resolved once, when
+# the user enters the index, instead of on every comparison in the matching loop.
+class _Entry:
+    __slots__ = (
+        "user_id", "order", "age", "gender", "religion",
+        "min_age", "max_age", "partner_gender", "partner_religion", "any_religion",
+    )
+
+    def __init__(self, user_id, prefs, order=None):
+        if not isinstance(prefs, Profile):
+            prefs = Profile.from_document(prefs)
+        self.user_id = user_id
+        self.order = order
+        self.age = prefs.age or 0
+        self.gender = prefs.gender
+        self.religion = prefs.religion
+        self.min_age = 0 if prefs.min_age is None else prefs.min_age
+        self.max_age = 100 if prefs.max_age is None else prefs.max_age
+        self.partner_gender = prefs.partner_gender or GENDER_ANY
+        self.partner_religion = prefs.partner_religion
+        self.any_religion = self.partner_religion in (0, RELIGION_ANY)
+
+    # Bucket group: own attributes plus partner gender and religion preferences,
+    # with None standing for any religion
+    @property
+    def group(self):
+        return (
+            self.gender,
+            self.religion,
+            self.partner_gender,
+            None if self.any_religion else self.partner_religion,
+        )
+
+    # True if this user's partner criteria accept a profile with the given attributes
+    def accepts(self, gender, religion, age):
+        return (
+            self.min_age <= age <= self.max_age
+            and (self.partner_gender == GENDER_ANY or self.partner_gender == gender)
+            and (self.any_religion or self.partner_religion == religion)
+        )
+
+# Flat matching attributes of a profile, for storing waiting users outside the index.
+# partner_religion is None when any religion is accepted.
+def match_fields(prefs):
+    entry = _Entry(None, prefs)
+    return {
+        "age": entry.age,
+        "gender": GENDERS.name(entry.gender) or "any",
+        "religion": RELIGIONS.name(entry.religion) or "Not set",
+        "min_age": entry.min_age,
+        "max_age": entry.max_age,
+        "partner_gender": GENDERS.name(entry.partner_gender),
+        "partner_religion": None if entry.any_religion else RELIGIONS.name(entry.partner_religion),
+    }
+
+# Two-way compatibility check on profiles, same rules as the index
+def is_compatible(user_prefs, candidate_prefs):
+    user = _Entry(None, user_prefs)
+    candidate = _Entry(None, candidate_prefs)
+    return (
+        candidate.accepts(user.gender, user.religion, user.age)
+        and user.accepts(candidate.gender, candidate.religion, candidate.age)
+    )
+
+# Waiting pool bucketed by (gender, religion, age). Buckets are grouped by the
+# waiting users' own partner gender and religion preferences too, so both
+# sides' gender and religion rules are settled per bucket and only the age
+# range is left to check per candidate. Each bucket is a FIFO queue ordered by
+# waiting start time, so a lookup only visits buckets that can satisfy both
+# sides and walks them oldest waiter first.
+class MatchIndex:
+    def __init__(self):
+        self._groups = {}
+        self._entries = {}
+        self._seq = count()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, user_id):
+        return user_id in self._entries
+
+    # Add a waiting user; started_at is the time they joined the queue
+    def add(self, user_id, prefs, started_at):
+        self.remove(user_id)
+        entry = _Entry(user_id, prefs, (started_at, next(self._seq)))
+        self._insert(entry)
+
+    # Re-index a waiting user after a profile change, keeping their queue position
+    def update(self, user_id, prefs):
+        old = self._entries.get(user_id)
+        if old is None:
+            return
+        self._discard(old)
+        self._insert(_Entry(user_id, prefs, old.order))
+
+    def remove(self, user_id):
+        entry = self._entries.get(user_id)
+        if entry is not None:
+            self._discard(entry)
+
+    # Return the longest-waiting compatible candidate for user_id, or None.
+    # is_excluded(candidate_id) lets the caller skip active chats and cooldowns.
+    def find(self, user_id, prefs, is_excluded=None):
+        for candidate in self.candidates(user_id, prefs):
+            if is_excluded is not None and is_excluded(candidate.user_id):
+                continue
+            return candidate.user_id
+        return None
+
+    # Greedily pair the whole waiting pool in one pass, oldest waiters first.
+    # Each user takes the longest-waiting compatible partner still free, so no
+    # two users left unpaired afterwards are compatible with each other.
+    # Paired users are removed from the index as they are claimed, so the
+    # caller must commit every returned pair.
+    # is_excluded(user_id, candidate_id) skips pairs such as those on cooldown.
+    def pair_all(self, is_excluded=None):
+        pairs = []
+        for entry in sorted(self._entries.values(), key=lambda item: item.order):
+            user_id = entry.user_id
+            if user_id not in self._entries:
+                continue
+            for candidate in self.candidates(user_id, None):
+                candidate_id = candidate.user_id
+                if is_excluded is not None and is_excluded(user_id, candidate_id):
+                    continue
+                pairs.append((user_id, candidate_id))
+                break
+            else:
+                continue
+            self._discard(entry)
+            self._discard(candidate)
+        return pairs
+
+    # Yield two-way compatible waiting entries for user_id, oldest waiter first
+    def candidates(self, user_id, prefs):
+        user = self._entries.get(user_id)
+        if user is None:
+            user = _Entry(user_id, prefs)
+        min_age, max_age = user.min_age, user.max_age
+        queues = []
+        for (gender, religion, partner_gender, partner_religion), buckets in self._groups.items():
+            if (
+                (user.partner_gender == GENDER_ANY or user.partner_gender == gender)
+                and (user.any_religion or user.partner_religion == religion)
+                and (partner_gender == GENDER_ANY or partner_gender == user.gender)
+                and (partner_religion is None or partner_religion == user.religion)
+            ):
+                queues.extend(bucket for age, bucket in buckets.items() if min_age <= age <= max_age)
+        age = user.age
+        for _, _, candidate in heapq.merge(*queues):
+            if candidate.min_age <= age <= candidate.max_age and candidate.user_id != user_id:
+                yield candidate
+
+    def _insert(self, entry):
+        self._entries[entry.user_id] = entry
+        buckets = self._groups.setdefault(entry.group, {})
+        insort(buckets.setdefault(entry.age, []), (*entry.order, entry))
+
+    def _discard(self, entry):
+        del self._entries[entry.user_id]
+        group = entry.group
+        buckets = self._groups[group]
+        bucket = buckets[entry.age]
+        del bucket[bisect_left(bucket, entry.order, key=lambda item: item[:2])]
+        if not bucket:
+            del buckets[entry.age]
+            if not buckets:
+                del self._groups[group]
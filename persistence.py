@@ -0,0 +1,205 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+# Resolve a dotted field path such as "partner.min_age" inside a user document
+def _get_path(document, path):
+    value = document
+    for part in path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return _MISSING
+        value = value[part]
+    return value
+
+# Write-behind store for user documents. Changes are recorded as dirty user IDs
+# (optionally narrowed to the fields that changed) and written to MongoDB as a
+# single bulk_write of $set updates, either on a schedule or as soon as
+# max_pending users are waiting to be written.
+class WriteBehindStore:
+    def __init__(self, collection, get_document, max_pending=500):
+        self._collection = collection
+        self._get_document = get_document
+        self._max_pending = max_pending
+        self._dirty = {}
+        self._lock = asyncio.Lock()
+        self._flush_task = None
+
+    def __len__(self):
+        return len(self._dirty)
+
+    def is_dirty(self, user_id):
+        return user_id in self._dirty
+
+    # Record a change; with no fields the whole document is written
+    def mark_dirty(self, user_id, *fields):
+        if not fields:
+            self._dirty[user_id] = None
+        elif user_id not in self._dirty:
+            self._dirty[user_id] = set(fields)
+        elif self._dirty[user_id] is not None:
+            self._dirty[user_id].update(fields)
+        if len(self._dirty) >= self._max_pending and (self._flush_task is None or self._flush_task.done()):
+            self._flush_task = asyncio.create_task(self._flush_quietly())
+
+    # Write every pending change, or only those of user_ids, in one bulk_write and
+    # return the number of users written
+    async def flush(self, user_ids=None):
+        async with self._lock:
+            if user_ids is None:
+                pending, self._dirty = self._dirty, {}
+            else:
+                pending = {user_id: self._dirty.pop(user_id) for user_id in user_ids if user_id in self._dirty}
+            if not pending:
+                return 0
+            operations = []
+            for user_id, fields in pending.items():
+                document = self._get_document(user_id)
+                if document is None:
+                    continue
+                if fields is None:
+                    update = {k: v for k, v in document.items() if k != '_id'}
+                else:
+                    update = {}
+                    for field in fields:
+                        if any(field.startswith(other + ".") for other in fields):
+                            continue
+                        value = _get_path(document, field)
+                        if value is not _MISSING:
+                            update[field] = value
+                if update:
+                    operations.append(UpdateOne({'_id': user_id}, {'$set': update}, upsert=True))
+            if not operations:
+                return 0
+            try:
+                await self._collection.bulk_write(operations, ordered=False)
+            except Exception:
+                self._requeue(pending)
+                raise
+            return len(operations)
+
+    async def _flush_quietly(self):
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error("❌ Error flushing %d pending user writes to MongoDB: %s", len(self._dirty), e)
+
+    # Put a failed batch back without losing changes recorded since it was taken
+    def _requeue(self, pending):
+        for user_id, fields in pending.items():
+            if user_id not in self._dirty:
+                self._dirty[user_id] = fields
+            elif fields is None:
+                self._dirty[user_id] = None
+            elif self._dirty[user_id] is not None:
+                self._dirty[user_id].update(fields)
+
+# Bounded LRU of user profiles loaded lazily from MongoDB. It behaves like the
+# user_data dict the handlers already use; load() fetches a profile the first
+# time it is needed, concurrent loads of the same user share one query, and the
+# least recently used profiles are evicted once capacity is exceeded. Users for
+# whom is_pinned(user_id) is true (waiting or chatting) and users with unsaved
+# changes are never evicted. from_document(document) converts a loaded document,
+# without its _id, into the in-memory profile. With shared=True other processes
+# also write the collection, so load() refetches a cached profile unless it has
+# unsaved changes here, and users without a document are not remembered.
+class ProfileCache:
+    def __init__(self, collection, capacity=10000, is_pinned=None, is_dirty=None, from_document=dict, shared=False):
+        self._collection = collection
+        self._from_document = from_document
+        self._shared = shared
+        self._capacity = capacity
+        self._is_pinned = is_pinned or (lambda user_id: False)
+        self._is_dirty = is_dirty or (lambda user_id: False)
+        self._profiles = OrderedDict()
+        self._missing = set()
+        self._loading = {}
+
+    def __len__(self):
+        return len(self._profiles)
+
+    def __contains__(self, user_id):
+        return user_id in self._profiles
+
+    def __getitem__(self, user_id):
+        profile = self._profiles[user_id]
+        self._profiles.move_to_end(user_id)
+        return profile
+
+    def __setitem__(self, user_id, profile):
+        self._profiles[user_id] = profile
+        self._profiles.move_to_end(user_id)
+        self._missing.discard(user_id)
+        self._evict(keep=user_id)
+
+    def get(self, user_id, default=None):
+        if user_id in self._profiles:
+            return self[user_id]
+        return default
+
+    def setdefault(self, user_id, default=None):
+        if user_id not in self._profiles:
+            self[user_id] = default
+        return self[user_id]
+
+    def items(self):
+        return self._profiles.items()
+
+    # A cached profile that load() can use as is
+    def _is_current(self, user_id):
+        return user_id in self._profiles and (not self._shared or self._is_dirty(user_id))
+
+    # Make sure a user's profile is in memory, fetching it from MongoDB if needed
+    async def load(self, user_id):
+        if self._is_current(user_id):
+            self._profiles.move_to_end(user_id)
+            return
+        if user_id in self._missing:
+            return
+        future = self._loading.get(user_id)
+        if future is None:
+            future = asyncio.ensure_future(self._collection.find_one({'_id': user_id}))
+            self._loading[user_id] = future
+            try:
+                document = await future
+            finally:
+                del self._loading[user_id]
+            if self._is_current(user_id):
+                return
+            if document is None:
+                if self._shared:
+                    return
+                if len(self._missing) >= self._capacity:
+                    self._missing.clear()
+                self._missing.add(user_id)
+                return
+            self[user_id] = self._from_document({k: v for k, v in document.items() if k != '_id'})
+        else:
+            await asyncio.shield(future)
+
+    # Fetch the profiles of several users with one query, skipping those load() would keep
+    async def load_many(self, user_ids):
+        missing = [user_id for user_id in user_ids if not self._is_current(user_id)]
+        if not missing:
+            return
+        async for document in self._collection.find({'_id': {'$in': missing}}):
+            user_id = document['_id']
+            if not self._is_current(user_id):
+                self[user_id] = self._from_document({k: v for k, v in document.items() if k != '_id'})
+
+    # Drop least recently used profiles until the cache fits, skipping pinned and
+    # dirty ones and keep, the profile just stored. While those fill the cache it
+    # is allowed to grow past capacity.
+    def _evict(self, keep=None):
+        skipped = 0
+        while len(self._profiles) > self._capacity and skipped < len(self._profiles):
+            user_id = next(iter(self._profiles))
+            if user_id == keep or self._is_pinned(user_id) or self._is_dirty(user_id):
+                self._profiles.move_to_end(user_id)
+                skipped += 1
+                continue
+            del self._profiles[user_id]
@@ -0,0 +1,146 @@
+# Compact user profiles. A profile is stored in MongoDB as a nested document:
+#
+#     {age: "25", gender: "male", religion: "Muslim",
+#      partner: {min_age: 18, max_age: 30, gender: "female", religion: "Any"}}
+#
+# In memory it is a Profile with one slot per field: ages are parsed to ints
+# once, and gender and religion are small integer codes from a Vocabulary, so
+# matching compares ints instead of strings. 0 / None means "not set".
+
+NOT_SET = "Not set"
+
+# Interns the values of one categorical field as small integer codes. Lookups
+# are case-insensitive; values not known up front (e.g. from old documents)
+# get the next free code, so converting back to a document is lossless.
+class Vocabulary:
+    __slots__ = ("_names", "_codes")
+
+    def __init__(self, *names):
+        self._names = [None]
+        self._codes = {}
+        for name in names:
+            self.code(name)
+
+    def code(self, name):
+        if name is None or name == NOT_SET:
+            return 0
+        key = str(name).lower()
+        code = self._codes.get(key)
+        if code is None:
+            code = self._codes[key] = len(self._names)
+            self._names.append(str(name))
+        return code
+
+    def name(self, code):
+        return self._names[code]
+
+GENDERS = Vocabulary("male", "female", "any")
+RELIGIONS = Vocabulary("Orthodox", "Muslim", "Protestant", "Any")
+GENDER_ANY = GENDERS.code("any")
+RELIGION_ANY = RELIGIONS.code("Any")
+
+def _parse_age(value):
+    if value is None or value == NOT_SET:
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+# Document path -> (slot, vocabulary or None for ages, label in the setup missing-fields list)
+FIELDS = {
+    "age": ("age", None, "Age"),
+    "gender": ("gender", GENDERS, "Gender"),
+    "religion": ("religion", RELIGIONS, "Religion"),
+    "partner.min_age": ("min_age", None, "Partner Minimum Age"),
+    "partner.max_age": ("max_age", None, "Partner Maximum Age"),
+    "partner.gender": ("partner_gender", GENDERS, "Partner Gender"),
+    "partner.religion": ("partner_religion", RELIGIONS, "Partner Religion"),
+}
+
+# One bit per field in Profile.filled, in FIELDS order
+FIELD_BITS = {path: 1 << bit for bit, path in enumerate(FIELDS)}
+ALL_FIELDS = (1 << len(FIELDS)) - 1
+
+# filled is a bitmask of the fields that are set. It is computed once when the
+# profile is created and kept up to date by set(), so completeness checks do not
+# walk the fields; assign fields through set() rather than to the slots directly.
+class Profile:
+    __slots__ = ("age", "gender", "religion", "min_age", "max_age", "partner_gender", "partner_religion", "filled")
+
+    def __init__(self, age=None, gender=0, religion=0, min_age=None, max_age=None, partner_gender=0, partner_religion=0):
+        self.age = age
+        self.gender = gender
+        self.religion = religion
+        self.min_age = min_age
+        self.max_age = max_age
+        self.partner_gender = partner_gender
+        self.partner_religion = partner_religion
+        self.filled = 0
+        for path, (slot, _, _) in FIELDS.items():
+            if getattr(self, slot):
+                self.filled |= FIELD_BITS[path]
+
+    def __repr__(self):
+        return f"Profile({self.to_document()!r})"
+
+    def __eq__(self, other):
+        if not isinstance(other, Profile):
+            return NotImplemented
+        return all(getattr(self, slot) == getattr(other, slot) for slot in self.__slots__)
+
+    @classmethod
+    def from_document(cls, document):
+        partner = document.get("partner") or {}
+        return cls(
+            age=_parse_age(document.get("age")),
+            gender=GENDERS.code(document.get("gender")),
+            religion=RELIGIONS.code(document.get("religion")),
+            min_age=_parse_age(partner.get("min_age")),
+            max_age=_parse_age(partner.get("max_age")),
+            partner_gender=GENDERS.code(partner.get("gender")),
+            partner_religion=RELIGIONS.code(partner.get("religion")),
+        )
+
+    # The MongoDB document shape, with only the fields that are set
+    def to_document(self):
+        document = {}
+        partner = {}
+        for path in FIELDS:
+            value = self.get(path)
+            if value is None:
+                continue
+            if path == "age":
+                value = str(value)
+            if path.startswith("partner."):
+                partner[path[len("partner."):]] = value
+            else:
+                document[path] = value
+        if partner:
+            document["partner"] = partner
+        return document
+
+    # Decoded value of a document path such as "partner.min_age", or default if not set
+    def get(self, path, default=None):
+        slot, vocabulary, _ = FIELDS[path]
+        value = getattr(self, slot)
+        if vocabulary is not None:
+            value = vocabulary.name(value)
+        return default if value is None else value
+
+    # Set a document path from its decoded value
+    def set(self, path, value):
+        slot, vocabulary, _ = FIELDS[path]
+        value = _parse_age(value) if vocabulary is None else vocabulary.code(value)
+        setattr(self, slot, value)
+        if value:
+            self.filled |= FIELD_BITS[path]
+        else:
+            self.filled &= ~FIELD_BITS[path]
+
+    def is_complete(self):
+        return self.filled == ALL_FIELDS
+
+    # Labels of the fields still missing before the user can start searching
+    def missing_fields(self):
+        return [label for path, (_, _, label) in FIELDS.items() if not self.filled & FIELD_BITS[path]]
@@ -0,0 +1,240 @@
+import asyncio
+import contextlib
+import logging
+from aiogram.types import InputMediaAudio, InputMediaDocument, InputMediaPhoto, InputMediaVideo
+
+logger = logging.getLogger(__name__)
+
+# Relay engine for chat messages. Every content type is described by one row of
+# RELAY_TABLE: how it is sent to the partner, how it is written to the channel
+# log and, for types that can be part of an album, how it becomes InputMedia.
+#
+# Modes:
+#   "text"     re-sent with send_message, with the label put before the text
+#   "caption"  copied with copy_message, with the label put before the caption
+#   "labelled" cannot carry a caption, so a label message is sent first and the
+#              item is then copied as a reply-threaded copy_message
+#
+# Everything is sent with protect_content, and replies are threaded with
+# reply_to_message_id. The channel log copy is re-sent by file_id instead (see
+# archive_call), so it still works after the sender deletes the message.
+
+class RelayKind:
+    __slots__ = ("mode", "describe", "input_media", "archive")
+
+    def __init__(self, mode, describe, input_media=None, archive=None):
+        self.mode = mode
+        self.describe = describe
+        self.input_media = input_media
+        self.archive = archive
+
+def _caption_line(message):
+    return f"📝 Caption: {message.caption}\n" if message.caption else ""
+
+def _with_caption(line):
+    return lambda message: line + _caption_line(message)
+
+def _describe_document(message):
+    return f"📎 Document: {message.document.file_name or 'Unnamed document'}\n" + _caption_line(message)
+
+# (Bot method, arguments) re-sending the media of a message by file_id
+def _resend(method, field, file_id, caption=True):
+    def archive(message):
+        kwargs = {field: file_id(message)}
+        if caption:
+            kwargs["caption"] = message.caption or ""
+        return method, kwargs
+    return archive
+
+RELAY_TABLE = {
+    "text": RelayKind("text", lambda message: f"📜 Text: {message.text}\n"),
+    "photo": RelayKind(
+        "caption", _with_caption("🖼️ Photo sent\n"),
+        lambda message, caption: InputMediaPhoto(media=message.photo[-1].file_id, caption=caption),
+        _resend("send_photo", "photo", lambda message: message.photo[-1].file_id)
+    ),
+    "document": RelayKind(
+        "caption", _describe_document,
+        lambda message, caption: InputMediaDocument(media=message.document.file_id, caption=caption),
+        _resend("send_document", "document", lambda message: message.document.file_id)
+    ),
+    "video": RelayKind(
+        "caption", _with_caption("🎥 Video sent\n"),
+        lambda message, caption: InputMediaVideo(media=message.video.file_id, caption=caption),
+        _resend("send_video", "video", lambda message: message.video.file_id)
+    ),
+    "audio": RelayKind(
+        "caption", _with_caption("🎵 Audio sent\n"),
+        lambda message, caption: InputMediaAudio(media=message.audio.file_id, caption=caption),
+        _resend("send_audio", "audio", lambda message: message.audio.file_id)
+    ),
+    "voice": RelayKind(
+        "caption", _with_caption("🎙️ Voice message sent\n"),
+        archive=_resend("send_voice", "voice", lambda message: message.voice.file_id)
+    ),
+    "animation": RelayKind(
+        "caption", _with_caption("🎞️ Animation sent\n"),
+        archive=_resend("send_animation", "animation", lambda message: message.animation.file_id)
+    ),
+    "video_note": RelayKind(
+        "labelled", lambda message: "🎥 Video note sent\n",
+        archive=_resend("send_video_note", "video_note", lambda message: message.video_note.file_id, caption=False)
+    ),
+    "sticker": RelayKind(
+        "labelled", lambda message: "🏷️ Sticker sent\n",
+        archive=_resend("send_sticker", "sticker", lambda message: message.sticker.file_id, caption=False)
+    ),
+}
+
+# Content types without a row are copied after a label message and only
+# described by their type in the channel log
+_OTHER = RelayKind("labelled", lambda message: f"📦 {message.content_type.replace('_', ' ').capitalize()} sent\n")
+
+def relay_kind(message):
+    return RELAY_TABLE.get(message.content_type, _OTHER)
+
+def label_text(label):
+    return label.rstrip()
+
+# Channel log lines for one relayed message
+def describe_message(message, label):
+    kind = relay_kind(message)
+    prefix = f"📜 Label: {label_text(label)}\n" if kind.mode == "labelled" else ""
+    return prefix + kind.describe(message)
+
+# Relay one message to chat_id and return the ID of the copy the partner sees
+async def relay_message(bot, message, chat_id, label, reply_to_message_id=None):
+    kind = relay_kind(message)
+    if kind.mode == "text":
+        sent = await bot.send_message(
+            chat_id=chat_id,
+            text=label + message.text,
+            reply_to_message_id=reply_to_message_id,
+            protect_content=True
+        )
+        return sent.message_id
+    if kind.mode == "labelled":
+        await bot.send_message(
+            chat_id=chat_id,
+            text=label_text(label),
+            reply_to_message_id=reply_to_message_id,
+            protect_content=True
+        )
+        copied = await bot.copy_message(
+            chat_id=chat_id,
+            from_chat_id=message.chat.id,
+            message_id=message.message_id,
+            reply_to_message_id=reply_to_message_id,
+            protect_content=True
+        )
+        return copied.message_id
+    copied = await bot.copy_message(
+        chat_id=chat_id,
+        from_chat_id=message.chat.id,
+        message_id=message.message_id,
+        caption=label + (message.caption or ""),
+        reply_to_message_id=reply_to_message_id,
+        protect_content=True
+    )
+    return copied.message_id
+
+# Relay an album as one send_media_group call. The label goes before the first
+# caption, or becomes the first item's caption when there is none. Returns the
+# partner's message IDs in the order of messages.
+async def relay_album(bot, messages, chat_id, label, reply_to_message_id=None):
+    captioned = next((message for message in messages if message.caption), None)
+    media = []
+    for message in messages:
+        if message is captioned:
+            caption = label + message.caption
+        elif captioned is None and message is messages[0]:
+            caption = label_text(label)
+        else:
+            caption = message.caption
+        media.append(relay_kind(message).input_media(message, caption))
+    sent = await bot.send_media_group(
+        chat_id=chat_id,
+        media=media,
+        reply_to_message_id=reply_to_message_id,
+        protect_content=True
+    )
+    return [sent_message.message_id for sent_message in sent]
+
+# (Bot method, arguments) re-sending a message's media by file_id for the
+# channel log, or None for text
+def archive_call(message):
+    archive = relay_kind(message).archive
+    return None if archive is None else archive(message)
+
+# InputMedia items re-sending an album by file_id with the original captions
+def archive_album(messages):
+    return [relay_kind(message).input_media(message, message.caption) for message in messages]
+
+def can_relay_as_album(messages):
+    return len(messages) > 1 and all(relay_kind(message).input_media is not None for message in messages)
+
+# Telegram delivers each album item as its own message sharing a media_group_id.
+# Items are buffered per (chat, media group) and handed to on_complete(messages)
+# in message order once no new item has arrived for delay seconds. hold(chat_id),
+# if given, is an async context manager serializing the chat's updates: albums
+# are delivered while holding it, and a handler that already holds it can take()
+# the chat's pending albums to relay them before a later message.
+class MediaGroupCollector:
+    def __init__(self, on_complete, delay=1.0, hold=None):
+        self._on_complete = on_complete
+        self._delay = delay
+        self._hold = hold or (lambda chat_id: contextlib.nullcontext())
+        self._groups = {}
+        self._timers = {}
+        self._tasks = set()
+
+    def __len__(self):
+        return len(self._groups)
+
+    def add(self, message):
+        key = (message.chat.id, message.media_group_id)
+        self._groups.setdefault(key, []).append(message)
+        timer = self._timers.get(key)
+        if timer is not None:
+            timer.cancel()
+        self._timers[key] = asyncio.get_running_loop().call_later(self._delay, self._complete, key)
+
+    # Remove and return the chat's pending albums, oldest first
+    def take(self, chat_id):
+        keys = sorted(
+            (key for key in self._groups if key[0] == chat_id),
+            key=lambda key: min(message.message_id for message in self._groups[key])
+        )
+        return [self._pop(key) for key in keys]
+
+    def _pop(self, key):
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        return sorted(self._groups.pop(key, []), key=lambda message: message.message_id)
+
+    def _complete(self, key):
+        self._timers.pop(key, None)
+        task = asyncio.ensure_future(self._deliver_group(key))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    # The album may have been taken by a handler while waiting for the chat
+    async def _deliver_group(self, key):
+        async with self._hold(key[0]):
+            messages = self._pop(key)
+            if messages:
+                await self._deliver(messages)
+
+    async def _deliver(self, messages):
+        try:
+            await self._on_complete(messages)
+        except Exception:
+            logger.exception("❌ Error relaying media group %s", messages[0].media_group_id)
+
+    # Hand over every buffered album now, e.g. at shutdown
+    async def flush(self):
+        for key in list(self._groups):
+            await self._deliver_group(key)
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
@@ -0,0 +1,59 @@
+import sys
+import time
+from array import array
+
+# Fixed-capacity map from one user's message IDs to the partner's copies, used
+# to thread replies. IDs live in compact int64 arrays used as a ring buffer:
+# once capacity is reached the oldest mapping is overwritten. With a ttl (in
+# seconds) mappings older than that are treated as missing.
+class MessageIdMap:
+    __slots__ = ("_capacity", "_ttl", "_keys", "_values", "_stamps", "_slots", "_next")
+
+    def __init__(self, capacity=1000, ttl=None):
+        self._capacity = capacity
+        self._ttl = ttl
+        self._keys = array("q")
+        self._values = array("q")
+        self._stamps = array("q")
+        self._slots = {}
+        self._next = 0
+
+    def __len__(self):
+        return len(self._slots)
+
+    def __contains__(self, message_id):
+        return self.get(message_id) is not None
+
+    def __setitem__(self, message_id, mapped_id):
+        now = int(time.monotonic())
+        slot = self._slots.get(message_id)
+        if slot is None:
+            if len(self._keys) < self._capacity:
+                slot = len(self._keys)
+                self._keys.append(message_id)
+                self._values.append(mapped_id)
+                self._stamps.append(now)
+                self._slots[message_id] = slot
+                return
+            slot = self._next
+            self._next = (slot + 1) % self._capacity
+            del self._slots[self._keys[slot]]
+            self._keys[slot] = message_id
+            self._slots[message_id] = slot
+        self._values[slot] = mapped_id
+        self._stamps[slot] = now
+
+    def get(self, message_id, default=None):
+        slot = self._slots.get(message_id)
+        if slot is None:
+            return default
+        if self._ttl is not None and time.monotonic() - self._stamps[slot] > self._ttl:
+            return default
+        return self._values[slot]
+
+    # Approximate memory used by this map in bytes
+    def nbytes(self):
+        return (
+            sys.getsizeof(self._slots)
+            + sum(sys.getsizeof(column) for column in (self._keys, self._values, self._stamps))
+        )
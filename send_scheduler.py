@@ -0,0 +1,114 @@
+import asyncio
+import time
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+
+# Bot API methods that post a message to a chat and count against flood limits
+SEND_METHODS = frozenset({
+    "SendMessage", "SendPhoto", "SendDocument", "SendVideo", "SendAudio", "SendVoice",
+    "SendVideoNote", "SendSticker", "SendAnimation", "SendMediaGroup",
+    "CopyMessage", "CopyMessages", "ForwardMessage", "ForwardMessages",
+})
+
+# Token bucket refilled at rate tokens per second, holding at most capacity tokens
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def is_full(self):
+        self._refill()
+        return self.tokens >= self.capacity
+
+    async def acquire(self):
+        while True:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class _ChatState:
+    __slots__ = ("lock", "bucket", "users")
+
+    def __init__(self, bucket):
+        self.lock = asyncio.Lock()
+        self.bucket = bucket
+        self.users = 0
+
+# Request middleware that paces every outbound send through a global and a
+# per-chat token bucket. Sends to the same chat are serialized in call order,
+# 429 responses are retried after the retry_after Telegram asks for, and
+# server or network errors are retried with exponential backoff.
+class SendScheduler(BaseRequestMiddleware):
+    def __init__(
+        self,
+        global_rate=30,
+        chat_rate=1,
+        group_rate=20 / 60,
+        chat_burst=3,
+        max_retries=5,
+        backoff=1.0,
+    ):
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chat_rate = chat_rate
+        self._group_rate = group_rate
+        self._chat_burst = chat_burst
+        self._max_retries = max_retries
+        self._backoff = backoff
+        self._chats = {}
+        self.retries = 0
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None or type(method).__name__ not in SEND_METHODS:
+            return await make_request(bot, method)
+        state = self._chat_state(chat_id)
+        state.users += 1
+        try:
+            async with state.lock:
+                return await self._send(make_request, bot, method, state.bucket)
+        finally:
+            state.users -= 1
+
+    async def _send(self, make_request, bot, method, bucket):
+        attempt = 0
+        while True:
+            await bucket.acquire()
+            await self._global.acquire()
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                if attempt >= self._max_retries:
+                    raise
+                delay = e.retry_after
+            except (TelegramServerError, TelegramNetworkError):
+                if attempt >= self._max_retries:
+                    raise
+                delay = self._backoff * 2 ** attempt
+            attempt += 1
+            self.retries += 1
+            await asyncio.sleep(delay)
+
+    def _chat_state(self, chat_id):
+        state = self._chats.get(chat_id)
+        if state is None:
+            if len(self._chats) >= 1000:
+                self._forget_idle_chats()
+            # Group and channel IDs are negative (or @usernames) and have a much lower limit
+            is_group = str(chat_id).startswith(("-", "@"))
+            rate = self._group_rate if is_group else self._chat_rate
+            state = self._chats[chat_id] = _ChatState(TokenBucket(rate, self._chat_burst))
+        return state
+
+    # Drop state for chats with no pending sends whose bucket has refilled
+    def _forget_idle_chats(self):
+        for chat_id in [chat_id for chat_id, state in self._chats.items() if not state.users and state.bucket.is_full()]:
+            del self._chats[chat_id]
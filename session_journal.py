@@ -0,0 +1,93 @@
+import datetime
+
+# Append-only journal of matchmaking events ("join", "leave", "match", "end")
+# kept in MongoDB so the in-memory waiting queue and active chats can be
+# rebuilt after a restart. Events are buffered by record() and written by
+# flush(); snapshot() stores the whole state as one document and deletes the
+# events it covers, so replay() only reads the last snapshot and the events
+# recorded after it.
+class SessionJournal:
+    def __init__(self, collection):
+        self._collection = collection
+        self._pending = []
+        self._seq = 0
+        self._snapshot_seq = 0
+
+    # Number of events recorded since the last snapshot
+    @property
+    def events_since_snapshot(self):
+        return self._seq - self._snapshot_seq
+
+    def record(self, event, user_id, partner_id=None, since=None):
+        self._seq += 1
+        entry = {'seq': self._seq, 'event': event, 'user_id': user_id, 'at': datetime.datetime.now()}
+        if partner_id is not None:
+            entry['partner_id'] = partner_id
+        if since is not None:
+            entry['since'] = since
+        self._pending.append(entry)
+
+    async def ensure_index(self):
+        await self._collection.create_index('seq')
+
+    async def flush(self):
+        if not self._pending:
+            return 0
+        pending, self._pending = self._pending, []
+        try:
+            await self._collection.insert_many(pending, ordered=True)
+        except Exception:
+            self._pending[:0] = pending
+            raise
+        return len(pending)
+
+    # Write the current state as the new starting point for replay. waiting maps
+    # user IDs to queue start times and active_matches maps each user to their partner.
+    async def snapshot(self, waiting, active_matches):
+        seq = self._seq
+        document = {
+            'seq': seq,
+            'waiting': [[user_id, since] for user_id, since in waiting.items()],
+            'pairs': [[user_id, match_id] for user_id, match_id in active_matches.items() if user_id < match_id],
+        }
+        await self.flush()
+        await self._collection.replace_one({'_id': 'snapshot'}, document, upsert=True)
+        await self._collection.delete_many({'event': {'$exists': True}, 'seq': {'$lte': seq}})
+        self._snapshot_seq = seq
+
+    # Rebuild state from the last snapshot plus later events. Returns the waiting
+    # users with their queue start times, in queue order, and the active pairs.
+    async def replay(self):
+        waiting = {}
+        active_matches = {}
+        snapshot = await self._collection.find_one({'_id': 'snapshot'})
+        seq = 0
+        if snapshot is not None:
+            seq = snapshot['seq']
+            for user_id, since in snapshot['waiting']:
+                waiting[user_id] = since
+            for user_id, match_id in snapshot['pairs']:
+                active_matches[user_id] = match_id
+                active_matches[match_id] = user_id
+        self._snapshot_seq = seq
+        cursor = self._collection.find({'event': {'$exists': True}, 'seq': {'$gt': seq}}).sort('seq', 1)
+        async for entry in cursor:
+            seq = entry['seq']
+            event = entry['event']
+            user_id = entry['user_id']
+            if event == "join":
+                waiting[user_id] = entry['since']
+            elif event == "leave":
+                waiting.pop(user_id, None)
+            elif event == "match":
+                match_id = entry['partner_id']
+                waiting.pop(user_id, None)
+                waiting.pop(match_id, None)
+                active_matches[user_id] = match_id
+                active_matches[match_id] = user_id
+            elif event == "end":
+                match_id = active_matches.pop(user_id, None)
+                if match_id is not None:
+                    active_matches.pop(match_id, None)
+        self._seq = seq
+        return dict(sorted(waiting.items(), key=lambda item: item[1])), active_matches
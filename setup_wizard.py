@@ -0,0 +1,122 @@
+import keyboards
+from profiles import NOT_SET
+
+# Declarative profile setup wizard. Each Step names the profile field it fills,
+# the callback data that opens its screen and the prefix of the callback data
+# carrying a chosen value, how that value is validated, and the step that
+# follows. A chosen value is written to the profile straight away; a step with
+# no next step ends the wizard ("Your profile" or "Partner Profile") and shows
+# its confirm text.
+
+class Step:
+    __slots__ = ("name", "field", "prefix", "parse", "prompt", "keyboard", "alert", "next", "opened_by", "confirm", "requires")
+
+    def __init__(self, name, field, prefix, parse, prompt, keyboard, alert=None, next=None, opened_by=None, confirm=None, requires=None):
+        self.name = name
+        self.field = field
+        self.prefix = prefix
+        # parse(raw) -> value to store, or None if raw is not a valid choice
+        self.parse = parse
+        # prompt and keyboard are either fixed or callables of the user's profile
+        self.prompt = prompt
+        self.keyboard = keyboard
+        # alert(value, profile) -> text shown when the value is chosen, if any
+        self.alert = alert
+        self.next = next
+        self.opened_by = opened_by
+        # confirm(profile) -> text shown when the wizard ends
+        self.confirm = confirm
+        # (field, message) that must already be set before a value is accepted
+        self.requires = requires
+
+def _choice(*names):
+    values = {name.lower(): name for name in names}
+    return lambda raw: values.get(raw.lower())
+
+# Every age offered by the age grids
+_AGES = range(keyboards.AGE_ROWS.start, keyboards.AGE_ROWS[-1] + 5)
+
+def _age(raw):
+    if not (raw.isascii() and raw.isdigit()) or int(raw) not in _AGES:
+        return None
+    return int(raw)
+
+def _your_profile_summary(profile):
+    return (
+        f"🎉 Your selections are confirmed:\n"
+        f"- 📅 Age: {profile.get('age', NOT_SET)}\n"
+        f"- 🚻 Gender: {profile.get('gender', NOT_SET)}\n"
+        f"- 🙏 Religion: {profile.get('religion', NOT_SET)}\n\n"
+        "Returning to the Setup menu..."
+    )
+
+def _partner_profile_summary(profile):
+    return (
+        f"🎉 Your partner preferences are confirmed:\n"
+        f"- 📅 Age Range: {profile.get('partner.min_age', NOT_SET)} to {profile.get('partner.max_age', NOT_SET)}\n"
+        f"- 🚻 Gender: {profile.get('partner.gender', NOT_SET).capitalize()}\n"
+        f"- 🙏 Religion: {profile.get('partner.religion', NOT_SET)}\n\n"
+        "Returning to the Setup menu..."
+    )
+
+STEPS = [
+    Step(
+        "age", "age", "selected_age_", _age,
+        "📅 Select your age:", keyboards.AGE_KEYBOARD,
+        alert=lambda age, profile: f"Your age is {age}", next="gender", opened_by="age",
+    ),
+    Step(
+        "gender", "gender", "selected_gender_", _choice("male", "female"),
+        "🚻 Please indicate your Gender:", keyboards.GENDER_KEYBOARD,
+        alert=lambda gender, profile: f"You selected {gender}", next="religion", opened_by="gender",
+    ),
+    Step(
+        "religion", "religion", "selected_religion_", _choice("Orthodox", "Muslim", "Protestant"),
+        "🙏 Please select your religion:", keyboards.RELIGION_KEYBOARD,
+        opened_by="religion", confirm=_your_profile_summary,
+    ),
+    Step(
+        "partner_min_age", "partner.min_age", "partner_min_age_", _age,
+        "📅 Select the **minimum age** for the partner:", keyboards.PARTNER_MIN_AGE_KEYBOARD,
+        next="partner_max_age", opened_by="partner_age",
+    ),
+    Step(
+        "partner_max_age", "partner.max_age", "partner_max_age_", _age,
+        lambda profile: f"📅 Selected minimum age: **{profile.get('partner.min_age')}**\nNow, select the **maximum age** for the partner:",
+        lambda profile: keyboards.partner_max_age_keyboard(profile.get("partner.min_age")),
+        alert=lambda max_age, profile: f"🎉 Partner age range set: From {profile.get('partner.min_age')} to {max_age}", next="partner_gender",
+        requires=("partner.min_age", "❌ Minimum age not set. Please start from minimum age selection."),
+    ),
+    Step(
+        "partner_gender", "partner.gender", "partner_gender_", _choice("male", "female"),
+        "🚻 Please select your partner's gender:", keyboards.PARTNER_GENDER_KEYBOARD,
+        alert=lambda gender, profile: f"🎉 Partner's Gender set to: {gender.capitalize()}", next="partner_religion", opened_by="partner_gender",
+    ),
+    Step(
+        "partner_religion", "partner.religion", "partner_religion_", _choice("Orthodox", "Muslim", "Protestant", "Any"),
+        "🙏 Please select your partner's religion:", keyboards.PARTNER_RELIGION_KEYBOARD,
+        opened_by="partner_religion", confirm=_partner_profile_summary,
+    ),
+]
+
+# Routes setup callback data to its step
+class SetupWizard:
+    def __init__(self, steps):
+        self.steps = {step.name: step for step in steps}
+        self._opened_by = {step.opened_by: step for step in steps if step.opened_by}
+        self._prefixes = {step.prefix: step for step in steps}
+
+    # aiogram filter: {"step": step, "value": raw value or None to open the step}
+    # for setup callback data, False for anything else
+    def route(self, callback):
+        data = callback.data
+        if data is None:
+            return False
+        step = self._opened_by.get(data)
+        if step is not None:
+            return {"step": step, "value": None}
+        head, _, raw = data.rpartition("_")
+        step = self._prefixes.get(head + "_")
+        if step is None or not raw:
+            return False
+        return {"step": step, "value": raw}
@@ -0,0 +1,347 @@
+import datetime
+import uuid
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from matchmaking import MatchIndex, match_fields
+
+# Matchmaking state (the waiting queue and active pairs) behind one async
+# interface, so bot.py works the same whether the state lives in this process
+# or is shared by several worker processes through MongoDB.
+#
+# States reported by get_state are "idle", "searching" and "chatting".
+
+# Default backend: everything in process memory, with the waiting pool kept in
+# a MatchIndex. No method awaits, so every operation is atomic on the event loop.
+# With a SessionJournal every state change is also recorded there, so restore()
+# can rebuild the queue and active pairs after a restart. match_index can be
+# any MatchIndex, e.g. the NumPy-backed one from vector_matching.
+class InMemoryStateBackend:
+    def __init__(self, journal=None, match_index=None):
+        self.waiting_users = set()
+        self.waiting_start_times = {}
+        self.active_matches = {}
+        self.match_index = MatchIndex() if match_index is None else match_index
+        self.journal = journal
+        # Queue start times of users in active pairs, so release_pair can requeue them in place
+        self.matched_since = {}
+
+    # Users whose profiles must stay in memory
+    def is_pinned(self, user_id):
+        return user_id in self.waiting_users or user_id in self.active_matches
+
+    async def get_state(self, user_id):
+        if user_id in self.active_matches:
+            return "chatting"
+        elif user_id in self.waiting_users:
+            return "searching"
+        return "idle"
+
+    async def get_partner(self, user_id):
+        return self.active_matches.get(user_id)
+
+    async def join_queue(self, user_id, prefs, started_at=None):
+        started_at = started_at or datetime.datetime.now()
+        self.waiting_start_times[user_id] = started_at
+        self.waiting_users.add(user_id)
+        self.match_index.add(user_id, prefs, started_at)
+        if self.journal is not None:
+            self.journal.record("join", user_id, since=started_at)
+        return started_at
+
+    # Returns False if the user was not waiting
+    async def leave_queue(self, user_id):
+        if user_id not in self.waiting_users:
+            return False
+        self._dequeue(user_id)
+        if self.journal is not None:
+            self.journal.record("leave", user_id)
+        return True
+
+    # Re-index a waiting user after a profile change; returns False if they are not waiting
+    async def update_profile(self, user_id, prefs):
+        if user_id not in self.waiting_users:
+            return False
+        self.match_index.update(user_id, prefs)
+        return True
+
+    # Longest-waiting compatible candidate; is_excluded(candidate_id) skips cooldowns
+    async def find_match(self, user_id, prefs, is_excluded):
+        return self.match_index.find(
+            user_id,
+            prefs,
+            lambda candidate_id: candidate_id in self.active_matches or is_excluded(candidate_id)
+        )
+
+    # Atomically move two waiting users into an active pair; False if either is no longer waiting
+    async def claim_pair(self, user_id, match_id):
+        if user_id not in self.waiting_users or match_id not in self.waiting_users:
+            return False
+        self._commit(user_id, match_id)
+        return True
+
+    # Pair the whole waiting pool in one pass and return the claimed pairs
+    async def pair_waiting(self, is_excluded):
+        pairs = self.match_index.pair_all(is_excluded)
+        for user_id, match_id in pairs:
+            self._commit(user_id, match_id)
+        return pairs
+
+    # End a user's chat and return the former partner, or None if they were not chatting
+    async def end_pair(self, user_id):
+        match_id = self.active_matches.pop(user_id, None)
+        if match_id is not None:
+            self.active_matches.pop(match_id, None)
+            self.matched_since.pop(user_id, None)
+            self.matched_since.pop(match_id, None)
+            if self.journal is not None:
+                self.journal.record("end", user_id, partner_id=match_id)
+        return match_id
+
+    # Undo a claimed pair whose announcement failed. Users in requeue (user ID ->
+    # profile) go back to waiting with their original queue start time; the
+    # others leave matchmaking. Returns False if the pair was no longer active.
+    async def release_pair(self, user_id, match_id, requeue):
+        if self.active_matches.get(user_id) != match_id:
+            return False
+        since = {member: self.matched_since.get(member) for member in (user_id, match_id)}
+        await self.end_pair(user_id)
+        for member, prefs in requeue.items():
+            await self.join_queue(member, prefs, since[member])
+        return True
+
+    # Rebuild state replayed from the journal. waiting maps user IDs to queue
+    # start times in queue order; users whose profile get_prefs cannot provide
+    # are left out of the queue. Returns the number of users put back in the queue.
+    def restore(self, waiting, active_matches, get_prefs):
+        self.active_matches.update(active_matches)
+        restored = 0
+        for user_id, started_at in waiting.items():
+            prefs = get_prefs(user_id)
+            if prefs is None or user_id in self.active_matches:
+                continue
+            self.waiting_start_times[user_id] = started_at
+            self.waiting_users.add(user_id)
+            self.match_index.add(user_id, prefs, started_at)
+            restored += 1
+        return restored
+
+    # Write buffered journal events, and a snapshot once snapshot_every events have
+    # accumulated since the last one
+    async def save_journal(self, snapshot_every):
+        if self.journal is None:
+            return
+        if self.journal.events_since_snapshot >= snapshot_every:
+            await self.journal.snapshot(dict(self.waiting_start_times), dict(self.active_matches))
+        else:
+            await self.journal.flush()
+
+    def _commit(self, user_id, match_id):
+        self.active_matches[user_id] = match_id
+        self.active_matches[match_id] = user_id
+        self.matched_since[user_id] = self.waiting_start_times.get(user_id)
+        self.matched_since[match_id] = self.waiting_start_times.get(match_id)
+        self._dequeue(user_id)
+        self._dequeue(match_id)
+        if self.journal is not None:
+            self.journal.record("match", user_id, partner_id=match_id)
+
+    def _dequeue(self, user_id):
+        self.waiting_users.discard(user_id)
+        self.waiting_start_times.pop(user_id, None)
+        self.match_index.remove(user_id)
+
+# Shared backend for running several bot workers against one MongoDB. Each
+# waiting or chatting user has one document in the sessions collection:
+#
+#     {_id: user_id, state: "waiting" | "chatting", since, partner,
+#      age, gender, religion, min_age, max_age, partner_gender, partner_religion}
+#
+# Candidates are found with an indexed query in waiting order, and pairs are
+# claimed with conditional find_one_and_update calls on state, so a user can
+# only ever be claimed by one worker. If the second half of a claim fails the
+# first half is rolled back and the candidate goes back to waiting.
+#
+# The batch matching pass runs on one worker at a time: with a leases
+# collection, a worker only runs it while it holds the "matching" lease, which
+# it renews on every pass and which another worker takes over lease_seconds
+# after the holder stops renewing it.
+class MongoStateBackend:
+    def __init__(self, collection, cooldowns_collection=None, leases_collection=None, lease_seconds=30):
+        self._collection = collection
+        self._cooldowns = cooldowns_collection
+        self._leases = leases_collection
+        self._lease_seconds = lease_seconds
+        self._worker_id = uuid.uuid4().hex
+
+    async def ensure_indexes(self):
+        await self._collection.create_index([('state', 1), ('gender', 1), ('religion', 1), ('since', 1)])
+        await self._collection.create_index([('state', 1), ('since', 1)])
+        if self._cooldowns is not None:
+            # find_match looks up a user's cooldowns on every call
+            await self._cooldowns.create_index([('users', 1), ('expires_at', 1)])
+
+    # Profiles are loaded on demand in every worker, so nothing is pinned locally
+    def is_pinned(self, user_id):
+        return False
+
+    async def get_state(self, user_id):
+        document = await self._collection.find_one({'_id': user_id}, {'state': 1})
+        if document is None:
+            return "idle"
+        return "chatting" if document['state'] == "chatting" else "searching"
+
+    async def get_partner(self, user_id):
+        document = await self._collection.find_one({'_id': user_id, 'state': 'chatting'}, {'partner': 1})
+        return document['partner'] if document else None
+
+    async def join_queue(self, user_id, prefs, started_at=None):
+        started_at = started_at or datetime.datetime.now()
+        await self._collection.update_one(
+            {'_id': user_id},
+            {'$set': {'state': 'waiting', 'since': started_at, **match_fields(prefs)}, '$unset': {'partner': ''}},
+            upsert=True
+        )
+        return started_at
+
+    async def leave_queue(self, user_id):
+        result = await self._collection.delete_one({'_id': user_id, 'state': 'waiting'})
+        return result.deleted_count > 0
+
+    async def update_profile(self, user_id, prefs):
+        result = await self._collection.update_one(
+            {'_id': user_id, 'state': 'waiting'},
+            {'$set': match_fields(prefs)}
+        )
+        return result.matched_count > 0
+
+    async def find_match(self, user_id, prefs, is_excluded):
+        user = match_fields(prefs)
+        query = {
+            'state': 'waiting',
+            '_id': {'$ne': user_id},
+            'age': {'$gte': user['min_age'], '$lte': user['max_age']},
+            'min_age': {'$lte': user['age']},
+            'max_age': {'$gte': user['age']},
+            'partner_gender': {'$in': ['any', user['gender']]},
+            'partner_religion': {'$in': [None, user['religion']]},
+        }
+        if user['partner_gender'] != "any":
+            query['gender'] = user['partner_gender']
+        if user['partner_religion'] is not None:
+            query['religion'] = user['partner_religion']
+        cooling = await self._cooling_partners(user_id)
+        if cooling:
+            query['_id'] = {'$ne': user_id, '$nin': list(cooling)}
+        async for document in self._collection.find(query, {'_id': 1}).sort('since', 1):
+            if not is_excluded(document['_id']):
+                return document['_id']
+        return None
+
+    async def claim_pair(self, user_id, match_id):
+        claimed = await self._collection.find_one_and_update(
+            {'_id': match_id, 'state': 'waiting'},
+            {'$set': {'state': 'chatting', 'partner': user_id}}
+        )
+        if claimed is None:
+            return False
+        own = await self._collection.find_one_and_update(
+            {'_id': user_id, 'state': 'waiting'},
+            {'$set': {'state': 'chatting', 'partner': match_id}}
+        )
+        if own is None:
+            await self._collection.update_one(
+                {'_id': match_id, 'state': 'chatting', 'partner': user_id},
+                {'$set': {'state': 'waiting'}, '$unset': {'partner': ''}}
+            )
+            return False
+        return True
+
+    # Pair the whole waiting pool in memory with a MatchIndex built from one read
+    # of the queue and one cooldown query, then claim only the chosen pairs.
+    # Returns no pairs while another worker holds the matching lease.
+    async def pair_waiting(self, is_excluded):
+        if not await self._acquire_lease("matching"):
+            return []
+        index = MatchIndex()
+        waiting = []
+        async for document in self._collection.find({'state': 'waiting'}).sort('since', 1):
+            prefs = {
+                'age': document['age'],
+                'gender': document['gender'],
+                'religion': document['religion'],
+                'partner': {
+                    'min_age': document['min_age'],
+                    'max_age': document['max_age'],
+                    'gender': document['partner_gender'],
+                    'religion': document['partner_religion'] or 'Any',
+                },
+            }
+            index.add(document['_id'], prefs, document['since'])
+            waiting.append(document['_id'])
+        if not waiting:
+            return []
+        cooling = await self._cooling_pairs(waiting)
+        pairs = []
+        for user_id, match_id in index.pair_all(
+            lambda user_id, candidate_id: frozenset((user_id, candidate_id)) in cooling or is_excluded(user_id, candidate_id)
+        ):
+            if await self.claim_pair(user_id, match_id):
+                pairs.append((user_id, match_id))
+        return pairs
+
+    # Take or renew a named lease for this worker; False while another worker holds it
+    async def _acquire_lease(self, name):
+        if self._leases is None:
+            return True
+        now = datetime.datetime.now(datetime.timezone.utc)
+        try:
+            await self._leases.find_one_and_update(
+                {'_id': name, '$or': [{'holder': self._worker_id}, {'expires_at': {'$lte': now}}]},
+                {'$set': {'holder': self._worker_id, 'expires_at': now + datetime.timedelta(seconds=self._lease_seconds)}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            return False
+        return True
+
+    # Claims keep each user's since field, so requeued users keep their queue position
+    async def release_pair(self, user_id, match_id, requeue):
+        released = False
+        for member, partner in ((user_id, match_id), (match_id, user_id)):
+            query = {'_id': member, 'state': 'chatting', 'partner': partner}
+            if member in requeue:
+                result = await self._collection.update_one(query, {'$set': {'state': 'waiting'}, '$unset': {'partner': ''}})
+                released = released or result.matched_count > 0
+            else:
+                result = await self._collection.delete_one(query)
+                released = released or result.deleted_count > 0
+        return released
+
+    async def end_pair(self, user_id):
+        document = await self._collection.find_one_and_delete({'_id': user_id, 'state': 'chatting'})
+        if document is None:
+            return None
+        match_id = document.get('partner')
+        await self._collection.delete_one({'_id': match_id, 'state': 'chatting', 'partner': user_id})
+        return match_id
+
+    # Unordered pairs on cooldown among user_ids, from one query
+    async def _cooling_pairs(self, user_ids):
+        if self._cooldowns is None:
+            return set()
+        now = datetime.datetime.now(datetime.timezone.utc)
+        pairs = set()
+        async for document in self._cooldowns.find({'users': {'$in': user_ids}, 'expires_at': {'$gt': now}}, {'users': 1}):
+            pairs.add(frozenset(document['users']))
+        return pairs
+
+    async def _cooling_partners(self, user_id):
+        if self._cooldowns is None:
+            return set()
+        now = datetime.datetime.now(datetime.timezone.utc)
+        partners = set()
+        async for document in self._cooldowns.find({'users': user_id, 'expires_at': {'$gt': now}}, {'users': 1}):
+            partners.update(document['users'])
+        partners.discard(user_id)
+        return partners
@@ -0,0 +1,65 @@
+import datetime
+import random
+import pytest
+from matchmaking import MatchIndex, is_compatible
+
+pytest.importorskip("numpy")
+from vector_matching import ColumnarMatchIndex
+
+GENDERS = ["male", "female"]
+RELIGIONS = ["Orthodox", "Muslim", "Protestant"]
+
+def make_document(rng):
+    min_age = rng.randint(18, 60)
+    return {
+        "age": str(rng.randint(18, 70)),
+        "gender": rng.choice(GENDERS),
+        "religion": rng.choice(RELIGIONS),
+        "partner": {
+            "min_age": min_age,
+            "max_age": rng.randint(min_age, 80),
+            "gender": rng.choice(GENDERS + ["any"]),
+            "religion": rng.choice(RELIGIONS + ["Any"]),
+        },
+    }
+
+# Longest-waiting compatible candidate by checking every waiting user
+def brute_force_find(waiting, user_id, document, is_excluded):
+    for candidate_id, (candidate, _) in sorted(waiting.items(), key=lambda item: item[1][1]):
+        if candidate_id == user_id or is_excluded(candidate_id):
+            continue
+        if is_compatible(document, candidate):
+            return candidate_id
+    return None
+
+@pytest.mark.parametrize("seed", range(5))
+def test_columnar_index_finds_the_same_candidate(seed):
+    rng = random.Random(seed)
+    python_index = MatchIndex()
+    columnar_index = ColumnarMatchIndex(capacity=8)
+    waiting = {}
+    start = datetime.datetime(2024, 1, 1)
+    for step in range(600):
+        user_id = rng.randrange(200)
+        action = rng.random()
+        if action < 0.5:
+            document = make_document(rng)
+            started_at = start + datetime.timedelta(seconds=rng.randrange(3600))
+            python_index.add(user_id, document, started_at)
+            columnar_index.add(user_id, document, started_at)
+            waiting[user_id] = (document, (started_at, step))
+        elif action < 0.6 and user_id in waiting:
+            document = make_document(rng)
+            python_index.update(user_id, document)
+            columnar_index.update(user_id, document)
+            waiting[user_id] = (document, waiting[user_id][1])
+        elif action < 0.7:
+            python_index.remove(user_id)
+            columnar_index.remove(user_id)
+            waiting.pop(user_id, None)
+        excluded = set(rng.sample(range(200), 20))
+        probe_id = rng.randrange(200)
+        probe = waiting[probe_id][0] if probe_id in waiting else make_document(rng)
+        expected = brute_force_find(waiting, probe_id, probe, excluded.__contains__)
+        assert python_index.find(probe_id, probe, excluded.__contains__) == expected
+        assert columnar_index.find(probe_id, probe, excluded.__contains__) == expected
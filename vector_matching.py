@@ -0,0 +1,122 @@
+import datetime
+import logging
+from matchmaking import MatchIndex, _Entry
+from profiles import GENDER_ANY
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+_MICROSECOND = datetime.timedelta(microseconds=1)
+
+# Queue start time as integer microseconds, so it fits an int64 column
+def _start_key(started_at):
+    if isinstance(started_at, datetime.datetime):
+        epoch = _EPOCH if started_at.tzinfo is None else _EPOCH.replace(tzinfo=datetime.timezone.utc)
+        return (started_at - epoch) // _MICROSECOND
+    return round(started_at * 1_000_000)
+
+# MatchIndex that also keeps the waiting pool in NumPy columns, one row per
+# waiting user. find() evaluates the two-way compatibility of every row in one
+# vectorized pass and takes the oldest compatible waiter with an argmin, so it
+# returns exactly the same candidate as MatchIndex.find(). The batch pair_all()
+# and the bucket bookkeeping are inherited unchanged; rows are kept in step
+# through _insert() and _discard(). Freed rows are reused by later inserts.
+class ColumnarMatchIndex(MatchIndex):
+    _COLUMNS = ("age", "gender", "religion", "min_age", "max_age", "partner_gender", "partner_religion", "start", "seq", "user_id")
+
+    def __init__(self, capacity=1024):
+        if np is None:
+            raise RuntimeError("ColumnarMatchIndex needs NumPy; install numpy or use MatchIndex")
+        super().__init__()
+        self._columns = {name: np.zeros(capacity, dtype=np.int64) for name in self._COLUMNS}
+        self._any_religion = np.zeros(capacity, dtype=bool)
+        self._valid = np.zeros(capacity, dtype=bool)
+        self._rows = {}
+        self._free = list(range(capacity - 1, -1, -1))
+
+    def find(self, user_id, prefs, is_excluded=None):
+        user = self._entries.get(user_id)
+        if user is None:
+            user = _Entry(user_id, prefs)
+        rows = self._compatible_rows(user)
+        if rows.size == 0:
+            return None
+        columns = self._columns
+        starts = columns["start"][rows]
+        seqs = columns["seq"][rows]
+        # Oldest waiter by (start, seq); only a skipped pick needs another pass
+        while True:
+            earliest = np.flatnonzero(starts == starts.min())
+            pick = earliest[np.argmin(seqs[earliest])]
+            candidate_id = int(columns["user_id"][rows[pick]])
+            if candidate_id != user_id and (is_excluded is None or not is_excluded(candidate_id)):
+                return candidate_id
+            rows = np.delete(rows, pick)
+            if rows.size == 0:
+                return None
+            starts = np.delete(starts, pick)
+            seqs = np.delete(seqs, pick)
+
+    # Rows of waiting users compatible with user in both directions
+    def _compatible_rows(self, user):
+        columns = self._columns
+        age = columns["age"]
+        mask = self._valid & (age >= user.min_age) & (age <= user.max_age)
+        mask &= columns["min_age"] <= user.age
+        mask &= columns["max_age"] >= user.age
+        if user.partner_gender != GENDER_ANY:
+            mask &= columns["gender"] == user.partner_gender
+        if not user.any_religion:
+            mask &= columns["religion"] == user.partner_religion
+        partner_gender = columns["partner_gender"]
+        mask &= (partner_gender == GENDER_ANY) | (partner_gender == user.gender)
+        mask &= self._any_religion | (columns["partner_religion"] == user.religion)
+        return np.flatnonzero(mask)
+
+    def _insert(self, entry):
+        super()._insert(entry)
+        if not self._free:
+            self._grow()
+        row = self._free.pop()
+        self._rows[entry.user_id] = row
+        columns = self._columns
+        columns["age"][row] = entry.age
+        columns["gender"][row] = entry.gender
+        columns["religion"][row] = entry.religion
+        columns["min_age"][row] = entry.min_age
+        columns["max_age"][row] = entry.max_age
+        columns["partner_gender"][row] = entry.partner_gender
+        columns["partner_religion"][row] = entry.partner_religion
+        columns["start"][row] = _start_key(entry.order[0])
+        columns["seq"][row] = entry.order[1]
+        columns["user_id"][row] = entry.user_id
+        self._any_religion[row] = entry.any_religion
+        self._valid[row] = True
+
+    def _discard(self, entry):
+        super()._discard(entry)
+        row = self._rows.pop(entry.user_id)
+        self._valid[row] = False
+        self._free.append(row)
+
+    def _grow(self):
+        capacity = len(self._valid)
+        for name, column in self._columns.items():
+            self._columns[name] = np.concatenate([column, np.zeros(capacity, dtype=np.int64)])
+        self._any_religion = np.concatenate([self._any_religion, np.zeros(capacity, dtype=bool)])
+        self._valid = np.concatenate([self._valid, np.zeros(capacity, dtype=bool)])
+        self._free.extend(range(2 * capacity - 1, capacity - 1, -1))
+
+# Match index for the given engine: "numpy" uses ColumnarMatchIndex when NumPy
+# is installed and falls back to the pure-Python MatchIndex otherwise
+def create_match_index(engine="python"):
+    if engine == "numpy":
+        if np is not None:
+            return ColumnarMatchIndex()
+        logger.warning("⚠️ NumPy is not installed; using the pure-Python match index")
+    return MatchIndex()